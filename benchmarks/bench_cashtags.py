@@ -0,0 +1,39 @@
+"""Measures how many chat messages per second the cashtag scanner can parse.
+
+Compares the single precompiled scanner against the two uncompiled `re.findall` passes
+    `Router.find_symbols` used before.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_cashtags
+"""
+
+import pathlib
+import re
+import timeit
+
+from common.cashtags import find_cashtags
+
+CORPUS = pathlib.Path(__file__).with_name("chat_corpus.txt").read_text().splitlines()
+
+OLD_STOCK_REGEX = "(?:^|[^\\$])\\$([a-zA-Z.]{1,6})"
+OLD_CRYPTO_REGEX = "[$]{2}([a-zA-Z]{1,20})"
+
+
+def two_pass(text: str):
+    """The scan `Router.find_symbols` used before `common.cashtags`."""
+    return set(re.findall(OLD_STOCK_REGEX, text)), set(re.findall(OLD_CRYPTO_REGEX, text))
+
+
+def main():
+    # Only messages with a $ reach the scanner in either bot.
+    messages = [m for m in CORPUS if "$" in m]
+
+    number = 2_000
+    print(f"{len(messages)} messages x {number} rounds")
+    for name, scanner in (("two pass", two_pass), ("single pass", find_cashtags)):
+        total = timeit.timeit(lambda: [scanner(m) for m in messages], number=number)
+        print(f"{name:>12}: {len(messages) * number / total:12,.0f} messages/second")
+
+
+if __name__ == "__main__":
+    main()
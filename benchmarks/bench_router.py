@@ -0,0 +1,218 @@
+"""Times the Router hot paths against recorded API payloads, without touching the network.
+
+Every case runs the real Router, MarketData and cg_Crypto code. Only the HTTP transport is swapped for
+    `benchmarks.fixtures`, and caches are cleared before each call so every call does the full amount of work.
+    Results are compared against benchmarks/baseline.json and the run fails if a case got slower.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_router
+    python -m benchmarks.bench_router --save-baseline   # after an intended change in performance
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+# Keep snapshots and shared rate limits from a real deployment out of the benchmark.
+os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="stockbot-bench-")
+os.environ.pop("RATE_LIMIT_DIR", None)
+os.environ.setdefault("MARKETDATA", "TOKEN")
+
+from benchmarks import fixtures  # noqa: E402
+from common.cg_Crypto import cg_Crypto  # noqa: E402
+from common.chart_renderer import ChartRenderer  # noqa: E402
+from common.symbol_router import Router  # noqa: E402
+
+BASELINE = pathlib.Path(__file__).with_name("baseline.json")
+CORPUS = pathlib.Path(__file__).with_name("chat_corpus.txt").read_text().splitlines()
+
+INLINE_QUERIES = ["a", "ap", "app", "tsla", "bit", "eth", "micro", "game", "doge", "nvidia corp"]
+PRICE_MESSAGES = ["$tsla", "$$btc", "$aapl $msft $nvda $amd $gme", "$$eth $$doge $$sol $tsla $brk.b"]
+
+
+def build_router() -> Router:
+    fixtures.install()
+
+    # CoinGecko's rate limit would turn the benchmark into a measure of sleeping.
+    bucket = cg_Crypto._get.bucket
+    bucket.rate = bucket.capacity = bucket._tokens = 1e9
+
+    router = Router("bench")
+
+    # Seed trending so `build_trending` has bot symbols to spark.
+    for message in PRICE_MESSAGES:
+        router.find_symbols(message)
+
+    return router
+
+
+def clear_caches(router: Router) -> None:
+    router.stock.quote_cache.clear()
+    router.stock.candles.clear()
+    router.stock.intraday.clear()
+    router.crypto.candles.clear()
+    router.crypto.snapshots.clear()
+
+
+def cases(router: Router) -> dict[str, Callable[[int], object]]:
+    """Each case is called with the iteration number, and clears the caches it would otherwise hit."""
+    messages = [m for m in CORPUS if "$" in m]
+    symbols = [router.find_symbols(m, trending_weight=0) for m in PRICE_MESSAGES]
+    tsla, btc = symbols[0][0], symbols[1][0]
+
+    def price_reply(i: int):
+        clear_caches(router)
+        return router.price_reply(symbols[i % len(symbols)])
+
+    def batch_price_reply(i: int):
+        clear_caches(router)
+        return router.batch_price_reply(symbols[i % len(symbols)])
+
+    def inline_search(i: int):
+        clear_caches(router)
+        return router.inline_search(INLINE_QUERIES[i % len(INLINE_QUERIES)])
+
+    def build_trending(i: int):
+        clear_caches(router)
+        return router.build_trending()
+
+    def stock_intra_chart(i: int):
+        clear_caches(router)
+        df = router.intra_reply(tsla)
+        return ChartRenderer.chart_key(tsla, "renko", "intra", df)
+
+    def stock_month_chart(i: int):
+        clear_caches(router)
+        df = router.chart_reply(tsla)
+        return ChartRenderer.chart_key(tsla, "candle", "1M", df)
+
+    def coin_intra_chart(i: int):
+        clear_caches(router)
+        df = router.intra_reply(btc)
+        return ChartRenderer.chart_key(btc, "renko", "intra", df)
+
+    return {
+        "find_symbols": lambda i: router.find_symbols(messages[i % len(messages)], trending_weight=0),
+        "inline_search": inline_search,
+        "price_reply": price_reply,
+        "batch_price_reply": batch_price_reply,
+        "trending": lambda i: router.trending(),
+        "build_trending": build_trending,
+        "stock_intra_chart": stock_intra_chart,
+        "stock_month_chart": stock_month_chart,
+        "coin_intra_chart": coin_intra_chart,
+    }
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1] if len(samples) > 1 else samples[0]
+
+
+def measure(func: Callable[[int], object], iterations: int, warmup: int, rounds: int) -> dict:
+    """Times `rounds` rounds of `iterations` calls of `func`, after `warmup` untimed calls.
+
+    Returns
+    -------
+    dict
+        Calls per second and latency percentiles in milliseconds over every call. best_p50_ms is the
+            lowest median of a single round, which is much less sensitive to a noisy machine and is
+            what gets compared against the baseline.
+    """
+    for i in range(warmup):
+        func(i)
+
+    latencies = []
+    medians = []
+    for _ in range(rounds):
+        round = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            func(i)
+            round.append((time.perf_counter() - start) * 1e3)
+        medians.append(statistics.median(round))
+        latencies += round
+
+    return {
+        "ops": 1e3 / statistics.fmean(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "best_p50_ms": min(medians),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, slack_ms: float = 0.01) -> list[str]:
+    """Cases whose best median is more than `tolerance` slower than the baseline. Differences under `slack_ms`
+    are ignored since they are within timer noise for the fastest cases.
+    """
+    regressions = []
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if result["best_p50_ms"] > base["best_p50_ms"] * (1 + tolerance) + slack_ms:
+            regressions.append(f"{name}: median {result['best_p50_ms']:.3f} ms vs baseline {base['best_p50_ms']:.3f} ms")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=100, help="Timed calls per round.")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="Rounds per case.")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed calls per case before timing.")
+    parser.add_argument("-k", "--cases", nargs="*", help="Only run these cases.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        help="Fraction a median can slow down before failing, 1.0 fails cases that take twice as long.",
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    router = build_router()
+
+    results = {}
+    print(f"{'case':<20}{'ops/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, func in cases(router).items():
+        if args.cases and name not in args.cases:
+            continue
+        result = results[name] = measure(func, args.iterations, args.warmup, args.rounds)
+        print(
+            f"{name:<20}{result['ops']:>10,.0f}{result['p50_ms']:>10.3f}{result['p90_ms']:>10.3f}"
+            f"{result['p99_ms']:>10.3f}{result['max_ms']:>10.3f}"
+        )
+
+    if args.save_baseline:
+        baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+        baseline |= {name: {key: round(r[key], 4) for key in ("best_p50_ms", "p50_ms", "p90_ms")} for name, r in results.items()}
+        BASELINE.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"Saved baseline to {BASELINE}")
+        return 0
+
+    if not BASELINE.exists():
+        print("No baseline to compare against, run with --save-baseline to store one.")
+        return 0
+
+    if regressions := compare(results, json.loads(BASELINE.read_text()), args.tolerance):
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        return 1
+
+    print(f"\nNo case is more than {args.tolerance:.0%} slower than the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        shutil.rmtree(os.environ["SNAPSHOT_DIR"], ignore_errors=True)
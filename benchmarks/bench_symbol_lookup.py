@@ -0,0 +1,69 @@
+"""Compares resolving $$ coin symbols with `cg_Crypto.lookup` against scanning the whole coin list.
+
+Run from the root of the repo:
+    python -m benchmarks.bench_symbol_lookup
+"""
+
+import random
+import string
+import timeit
+
+from common.cg_Crypto import cg_Crypto
+
+COINS = 15_000
+LOOKUPS = ["btc", "eth", "doge", "xno", "sol", "notacoin"]
+
+
+def fake_coin_list(n: int = COINS, seed: int = 42) -> list[dict]:
+    """Builds a /coins/list sized payload with a few well known coins mixed in."""
+    rng = random.Random(seed)
+    coins = [
+        {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin"},
+        {"id": "ethereum", "symbol": "eth", "name": "Ethereum"},
+        {"id": "dogecoin", "symbol": "doge", "name": "Dogecoin"},
+        {"id": "nano", "symbol": "xno", "name": "Nano"},
+        {"id": "solana", "symbol": "sol", "name": "Solana"},
+    ]
+    while len(coins) < n:
+        symbol = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 6)))
+        coins.append({"id": f"{symbol}-{len(coins)}", "symbol": symbol, "name": symbol.title() + " Token"})
+    return coins
+
+
+def build_crypto(coins: list[dict]) -> cg_Crypto:
+    """Creates a cg_Crypto loaded with `coins` without touching the network."""
+    crypto = cg_Crypto.__new__(cg_Crypto)
+    crypto.set_symbol_list(coins)
+    return crypto
+
+
+def scan(crypto: cg_Crypto, symbol: str) -> str | None:
+    """The lookup `Router.find_symbols` used before coins were looked up by symbol, returning the first coins id."""
+    ids = crypto.symbol_list[crypto.symbol_list["symbol"].str.fullmatch(symbol, case=False)]["id"]
+    return ids.iloc[0] if len(ids) else None
+
+
+def main():
+    coins = fake_coin_list()
+    crypto = build_crypto(coins)
+
+    for symbol in LOOKUPS:
+        coin = crypto.lookup(symbol)
+        assert scan(crypto, symbol) == (coin.id if coin is not None else None)
+
+    number = 200
+    results = {
+        "full scan": timeit.timeit(lambda: [scan(crypto, s) for s in LOOKUPS], number=number),
+        "lookup": timeit.timeit(lambda: [crypto.lookup(s) for s in LOOKUPS], number=number),
+    }
+    load = timeit.timeit(lambda: crypto.set_symbol_list(coins), number=5) / 5
+
+    print(f"{COINS:,} coins, {len(LOOKUPS)} lookups x {number} rounds")
+    for name, total in results.items():
+        print(f"{name:>12}: {total / (number * len(LOOKUPS)) * 1e6:9.1f} µs per lookup")
+    print(f"{'speedup':>12}: {results['full scan'] / results['lookup']:9.1f}x")
+    print(f"{'list load':>12}: {load * 1e3:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
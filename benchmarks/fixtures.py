@@ -0,0 +1,338 @@
+"""Recorded API payloads and a requests transport that answers from them, so the bots code can run without a network.
+
+The payloads live in benchmarks/data. They were generated once with a fixed seed in the same shape
+    as real SEC, MarketData.app and CoinGecko responses, and can be rebuilt with:
+    python -m benchmarks.fixtures
+"""
+
+import gzip
+import hashlib
+import json
+import pathlib
+import random
+import string
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from benchmarks.bench_symbol_lookup import fake_coin_list
+from common.sessions import get_session
+
+DATA_DIR = pathlib.Path(__file__).with_name("data")
+
+# Tickers and coins that the recorded payloads have specific responses for.
+KNOWN_STOCKS = {
+    "AAPL": "Apple Inc.",
+    "MSFT": "MICROSOFT CORP",
+    "NVDA": "NVIDIA CORP",
+    "AMZN": "AMAZON COM INC",
+    "GOOGL": "Alphabet Inc.",
+    "META": "Meta Platforms, Inc.",
+    "TSLA": "Tesla, Inc.",
+    "BRK-B": "BERKSHIRE HATHAWAY INC",
+    "AMD": "ADVANCED MICRO DEVICES INC",
+    "GME": "GameStop Corp.",
+    "AMC": "AMC ENTERTAINMENT HOLDINGS, INC.",
+    "PLTR": "Palantir Technologies Inc.",
+}
+
+
+def random_walk(rng: random.Random, start: float, n: int, volatility: float = 0.01) -> list[tuple[float, float, float, float]]:
+    """Open, high, low and close of `n` bars."""
+    bars = []
+    close = start
+    for _ in range(n):
+        open = close
+        close = max(0.01, open * (1 + rng.gauss(0, volatility)))
+        high = max(open, close) * (1 + abs(rng.gauss(0, volatility / 2)))
+        low = min(open, close) * (1 - abs(rng.gauss(0, volatility / 2)))
+        bars.append((round(open, 2), round(high, 2), round(low, 2), round(close, 2)))
+    return bars
+
+
+def candle_payload(rng: random.Random, start: float, n: int, interval: int) -> dict:
+    """MarketData.app /stocks/candles/ response of `n` bars `interval` seconds apart, ending at 0."""
+    bars = random_walk(rng, start, n)
+    return {
+        "s": "ok",
+        "t": [(i - n + 1) * interval for i in range(n)],
+        "o": [b[0] for b in bars],
+        "h": [b[1] for b in bars],
+        "l": [b[2] for b in bars],
+        "c": [b[3] for b in bars],
+        "v": [rng.randint(10_000, 5_000_000) for _ in range(n)],
+    }
+
+
+def quote_payload(rng: random.Random, symbol: str) -> dict:
+    """MarketData.app /stocks/quotes/ response."""
+    last = round(rng.uniform(5, 900), 2)
+    change = round(last * rng.gauss(0, 0.02), 2)
+    return {
+        "s": "ok",
+        "symbol": [symbol],
+        "ask": [round(last + 0.02, 2)],
+        "askSize": [rng.randint(1, 900)],
+        "bid": [round(last - 0.02, 2)],
+        "bidSize": [rng.randint(1, 900)],
+        "mid": [last],
+        "last": [last],
+        "change": [change],
+        "changepct": [round(change / (last - change), 4)],
+        "volume": [rng.randint(100_000, 90_000_000)],
+        "updated": [1_700_000_000],
+    }
+
+
+def options_payload(rng: random.Random, underlying: str) -> dict:
+    """MarketData.app /options/quotes/ response for a call about a month out."""
+    price = round(rng.uniform(50, 400), 2)
+    strike = round(price / 5) * 5
+    mid = round(max(price - strike, 0) + rng.uniform(1, 10), 2)
+    return {
+        "s": "ok",
+        "optionSymbol": [f"{underlying}250117C{strike * 1000:08.0f}"],
+        "underlying": [underlying],
+        "expiration": [1_737_147_600],
+        "side": ["call"],
+        "strike": [strike],
+        "firstTraded": [1_663_767_000],
+        "dte": [30],
+        "updated": [1_700_000_000],
+        "bid": [round(mid - 0.05, 2)],
+        "bidSize": [rng.randint(1, 200)],
+        "mid": [mid],
+        "ask": [round(mid + 0.05, 2)],
+        "askSize": [rng.randint(1, 200)],
+        "last": [mid],
+        "openInterest": [rng.randint(100, 90_000)],
+        "volume": [rng.randint(10, 40_000)],
+        "inTheMoney": [price > strike],
+        "intrinsicValue": [round(max(price - strike, 0), 2)],
+        "extrinsicValue": [round(mid - max(price - strike, 0), 2)],
+        "underlyingPrice": [price],
+        "iv": [round(rng.uniform(0.2, 0.9), 3)],
+        "delta": [round(rng.uniform(0.3, 0.8), 3)],
+        "gamma": [round(rng.uniform(0.005, 0.03), 3)],
+        "theta": [round(-rng.uniform(0.05, 0.4), 3)],
+        "vega": [round(rng.uniform(0.1, 0.4), 3)],
+        "rho": [round(rng.uniform(0.05, 0.2), 3)],
+    }
+
+
+def generate(seed: int = 42) -> None:
+    """Writes every fixture to DATA_DIR."""
+    rng = random.Random(seed)
+    DATA_DIR.mkdir(exist_ok=True)
+
+    # SEC company_tickers.json, ranked by market cap with the well known tickers first.
+    tickers = list(KNOWN_STOCKS.items())
+    seen = set(KNOWN_STOCKS)
+    while len(tickers) < 10_000:
+        ticker = "".join(rng.choices(string.ascii_uppercase, k=rng.randint(1, 5)))
+        if ticker not in seen:
+            seen.add(ticker)
+            words = rng.choices(["Global", "Holdings", "Energy", "Bio", "Capital", "Systems", "Pharma", "Tech"], k=2)
+            tickers.append((ticker, f"{ticker.title()} {' '.join(words)} Inc"))
+    sec = {str(rank): {"cik_str": 1_000_000 + rank, "ticker": t, "title": title} for rank, (t, title) in enumerate(tickers)}
+    # mtime=0 keeps the gzip header, and so the files, the same every time they are generated.
+    with gzip.GzipFile(DATA_DIR / "sec_tickers.json.gz", "wb", mtime=0) as f:
+        f.write(json.dumps(sec, separators=(",", ":")).encode())
+
+    with gzip.GzipFile(DATA_DIR / "coins_list.json.gz", "wb", mtime=0) as f:
+        f.write(json.dumps(fake_coin_list(seed=seed), separators=(",", ":")).encode())
+
+    marketdata = {
+        "quotes": {symbol: quote_payload(rng, symbol) for symbol in KNOWN_STOCKS},
+        "default_quote": quote_payload(rng, "XXXX"),
+        # A day of 15 minute bars including extended hours, and a month of daily bars.
+        "intraday": candle_payload(rng, 180, 64, 15 * 60),
+        "daily": candle_payload(rng, 180, 21, 24 * 3600),
+    }
+    (DATA_DIR / "marketdata.json").write_text(json.dumps(marketdata, indent=1))
+
+    coingecko = {
+        "prices": {
+            "bitcoin": {"usd": 67_012.0, "usd_24h_change": 1.82},
+            "ethereum": {"usd": 3_204.11, "usd_24h_change": -0.74},
+            "dogecoin": {"usd": 0.1312, "usd_24h_change": 4.4},
+            "nano": {"usd": 1.02, "usd_24h_change": None},
+            "solana": {"usd": 151.9, "usd_24h_change": 2.96},
+        },
+        "trending": {
+            "coins": [
+                {
+                    "item": {
+                        "id": coin["id"],
+                        "coin_id": rank,
+                        "name": coin["name"],
+                        "symbol": coin["symbol"].upper(),
+                        "market_cap_rank": rank,
+                        "score": rank,
+                        # The last few are missing the change so the /simple/price fallback is exercised.
+                        "data": {"price_change_percentage_24h": {"usd": round(rng.gauss(0, 8), 3)}} if rank < 12 else {},
+                    }
+                }
+                for rank, coin in enumerate(fake_coin_list(seed=seed)[:15])
+            ]
+        },
+        # CoinGecko picks 30 minute candles for a day, and 4 hour candles for a month. Timestamps are in ms.
+        "ohlc_1d": [[(i - 47) * 1_800_000, *bar] for i, bar in enumerate(random_walk(rng, 67_000, 48))],
+        "ohlc_30d": [[(i - 179) * 14_400_000, *bar] for i, bar in enumerate(random_walk(rng, 67_000, 180, 0.02))],
+    }
+    (DATA_DIR / "coingecko.json").write_text(json.dumps(coingecko, indent=1))
+
+    # Generated last so adding it left the other payloads unchanged.
+    marketdata["options"] = options_payload(rng, "XXXX")
+    (DATA_DIR / "marketdata.json").write_text(json.dumps(marketdata, indent=1))
+
+
+class FixtureAPI:
+    """
+    Answers SEC, MarketData.app and CoinGecko requests from the recorded payloads.
+
+    Requests are routed by path alone since the three APIs don't share any paths, which lets one
+        server stand in for all of them, see `benchmarks.mock_api`.
+
+    Candle timestamps are recorded relative to the latest bar, and are moved to end at the current time
+        when served so the code that trims candles to the current session keeps them.
+    """
+
+    def __init__(self) -> None:
+        with gzip.open(DATA_DIR / "sec_tickers.json.gz", "rb") as f:
+            self.sec = f.read()
+        with gzip.open(DATA_DIR / "coins_list.json.gz", "rb") as f:
+            self.coins = f.read()
+
+        self.marketdata = json.loads((DATA_DIR / "marketdata.json").read_text())
+        self.coingecko = json.loads((DATA_DIR / "coingecko.json").read_text())
+        self.trending = json.dumps(self.coingecko["trending"]).encode()
+
+    def handle(self, path: str, query: dict[str, str]) -> tuple[int, bytes]:
+        """Finds the response for a request.
+
+        Parameters
+        ----------
+        path : str
+            ie: /api/v3/simple/price
+        query : dict[str, str]
+            Query parameters.
+
+        Returns
+        -------
+        tuple[int, bytes]
+            Status code and JSON body.
+        """
+        parts = path.strip("/").split("/")
+
+        if path == "/files/company_tickers.json":
+            return 200, self.sec
+
+        if parts[:2] == ["v1", "options"] and len(parts) > 3 and parts[2] == "quotes":
+            underlying = parts[3].split()[0].upper()
+            options = self.marketdata["options"] | {"underlying": [underlying]}
+            return 200, json.dumps(options).encode()
+
+        if parts[:2] == ["v1", "stocks"]:
+            match parts[2:]:
+                case ["quotes", symbol]:
+                    return 200, json.dumps(self.quote(symbol)).encode()
+                case ["bulkquotes"]:
+                    quotes = [self.quote(symbol) for symbol in query.get("symbols", "").split(",") if symbol]
+                    columns = {key: [q[key][0] for q in quotes] for key in self.marketdata["default_quote"] if key != "s"}
+                    return 200, json.dumps({"s": "ok"} | columns).encode()
+                case ["candles", resolution, _symbol]:
+                    return 200, json.dumps(self.candles(resolution, query)).encode()
+
+        if parts[:2] == ["api", "v3"]:
+            match parts[2:]:
+                case ["ping"]:
+                    return 200, b'{"gecko_says":"(V3) To the Moon!"}'
+                case ["coins", "list"]:
+                    return 200, self.coins
+                case ["search", "trending"]:
+                    return 200, self.trending
+                case ["simple", "price"]:
+                    ids = query.get("ids", "").split(",")
+                    return 200, json.dumps({id: self.coin_price(id) for id in ids if id}).encode()
+                case ["coins", _id, "ohlc"]:
+                    ohlc = self.coingecko["ohlc_1d" if query.get("days") == "1" else "ohlc_30d"]
+                    now = int(time.time() * 1000)
+                    return 200, json.dumps([[now + bar[0], *bar[1:]] for bar in ohlc]).encode()
+
+        return 404, b'{"error":"Not Found"}'
+
+    def quote(self, symbol: str) -> dict:
+        quote = self.marketdata["quotes"].get(symbol) or self.marketdata["default_quote"] | {"symbol": [symbol]}
+        return quote
+
+    def candles(self, resolution: str, query: dict[str, str]) -> dict:
+        payload = dict(self.marketdata["intraday" if resolution == "15" else "daily"])
+        interval = 15 * 60 if resolution == "15" else 24 * 3600
+        latest = int(time.time()) // interval * interval
+
+        times = [latest + t for t in payload["t"]]
+        try:
+            start = float(query["from"])
+        except (KeyError, ValueError):
+            start = 0
+
+        keep = [i for i, t in enumerate(times) if t >= start]
+        if not keep:
+            return {"s": "no_data"}
+
+        payload["t"] = [times[i] for i in keep]
+        for key in "ohlcv":
+            payload[key] = [payload[key][i] for i in keep]
+        return payload
+
+    def coin_price(self, id: str) -> dict:
+        if price := self.coingecko["prices"].get(id):
+            return price
+        # Coins without a recorded price get a stable made up one.
+        digest = int(hashlib.sha1(id.encode()).hexdigest()[:8], 16)
+        return {"usd": round(digest % 10_000 / 100, 2), "usd_24h_change": round(digest % 2_000 / 100 - 10, 2)}
+
+
+class FixtureAdapter(BaseAdapter):
+    """requests transport adapter that answers every request from a FixtureAPI instead of the network."""
+
+    def __init__(self, api: FixtureAPI) -> None:
+        super().__init__()
+        self.api = api
+
+    def send(self, request: PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None) -> Response:
+        url = urlsplit(request.url)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        status, body = self.api.handle(unquote(url.path), query)
+
+        resp = Response()
+        resp.status_code = status
+        resp.reason = "OK" if status == 200 else "Not Found"
+        resp._content = body
+        resp.headers = CaseInsensitiveDict({"Content-Type": "application/json", "Content-Length": str(len(body))})
+        resp.encoding = "utf-8"
+        resp.url = request.url
+        resp.request = request
+        return resp
+
+    def close(self) -> None:
+        pass
+
+
+def install(providers: tuple[str, ...] = ("sec", "marketdata", "coingecko", "uptimerobot")) -> FixtureAPI:
+    """Points the shared sessions of each provider at the fixtures."""
+    api = FixtureAPI()
+    adapter = FixtureAdapter(api)
+    for provider in providers:
+        get_session(provider).mount("https://", adapter)
+        get_session(provider).mount("http://", adapter)
+    return api
+
+
+if __name__ == "__main__":
+    generate()
+    print(f"Wrote fixtures to {DATA_DIR}")
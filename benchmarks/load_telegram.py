@@ -0,0 +1,379 @@
+"""Drives the Telegram bots real handlers with synthetic updates to find how many messages per second it keeps up with.
+
+Updates come from thousands of fake group chats and mix cashtag chatter from benchmarks/chat_corpus.txt, `/chart`,
+    `/intra`, `/trending` and inline queries. They are put on the `Application` update queue at a steady rate, so
+    they go through the same handlers, filters and error handling as updates from Telegram. The Bot API is replaced
+    by `StubRequest`, which answers immediately and notes when each reply is sent. Latency is the time from an
+    update being queued until the bot sends its first reply to it.
+
+The rate steps up until replies fall behind, the highest rate that still kept up is the saturation point.
+    Stock and coin data comes from `benchmarks.fixtures`, or from `benchmarks.mock_api` with `--mock-api` to
+    include HTTP and injected upstream latency.
+
+Run from the root of the repo:
+    python -m benchmarks.load_telegram
+    python -m benchmarks.load_telegram --rates 10 20 40 80 --duration 20 --bot-latency 50
+    python -m benchmarks.load_telegram --mock-api http://127.0.0.1:8080
+"""
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import pathlib
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks import fixtures
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+CORPUS = pathlib.Path(__file__).with_name("chat_corpus.txt").read_text().splitlines()
+
+STOCKS = [f"${symbol.replace('-', '.')}" for symbol in fixtures.KNOWN_STOCKS]
+COINS = ["$$btc", "$$eth", "$$doge", "$$sol"]
+INLINE_QUERIES = ["a", "ap", "app", "tsla", "bit", "eth", "micro", "game", "doge", "nvidia corp"]
+
+# Relative share of each kind of update.
+DEFAULT_MIX = {"chatter": 60, "chart": 8, "intra": 8, "trending": 4, "inline": 20}
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Simple Stock Bot", "username": "SimpleStockBot"}
+
+
+class Tracker:
+    """Matches replies to the updates they answer, by message id in groups and by id for inline queries."""
+
+    def __init__(self) -> None:
+        self.sent: dict[str, float] = {}
+        self.latencies: dict[str, float] = {}
+        self.errors = 0
+        self.first_reply: float | None = None
+        self.last_reply = 0.0
+
+    def queued(self, key: str) -> None:
+        self.sent[key] = time.perf_counter()
+
+    def replied(self, key: str | None, text: str = "") -> None:
+        now = time.perf_counter()
+        if key is None or key not in self.sent or key in self.latencies:
+            return
+        self.latencies[key] = now - self.sent[key]
+        self.first_reply = self.first_reply or now
+        self.last_reply = now
+        if text.startswith("An error has occured"):
+            self.errors += 1
+
+    def achieved(self, rate: float) -> float:
+        """Rate the replies kept up with, `rate` scaled by how much longer replying took than queuing."""
+        if len(self.latencies) < 2:
+            return 0.0
+        queued = max(self.sent.values()) - min(self.sent.values())
+        replied = self.last_reply - self.first_reply
+        return rate * queued / replied if replied > 0 else rate
+
+    def waiting(self) -> int:
+        return len(self.sent) - len(self.latencies)
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+class StubRequest(BaseRequest):
+    """
+    Bot API transport that answers every call without a network.
+
+    Sent messages get a made up response shaped like Telegram's, with a photo for `sendPhoto` since the chart
+        handlers keep the uploaded file_id. `latency` seconds are waited before answering to stand in for the
+        round trip to Telegram.
+    """
+
+    def __init__(self, tracker: Tracker, latency: float = 0.0) -> None:
+        self.tracker = tracker
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self.ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        match endpoint:
+            case "getMe":
+                result = BOT_USER
+            case "sendMessage" | "sendPhoto":
+                result = self.message(endpoint, params)
+                reply_to = params.get("reply_to_message_id")
+                self.tracker.replied(None if reply_to is None else str(reply_to), params.get("text", ""))
+            case "answerInlineQuery":
+                result = True
+                self.tracker.replied(params.get("inline_query_id"))
+            case _:
+                result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def message(self, endpoint: str, params: dict) -> dict:
+        message = {
+            "message_id": next(self.ids),
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "group", "title": "Load Test"},
+            "from": BOT_USER,
+        }
+        if endpoint == "sendPhoto":
+            file_id = f"photo-{message['message_id']}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}]
+            message["caption"] = params.get("caption", "")
+        else:
+            message["text"] = params.get("text", "")
+        return message
+
+
+class UpdateFactory:
+    """Builds random updates from `chats` different group chats, each with its own user."""
+
+    def __init__(self, bot, router, chats: int, mix: dict[str, float], seed: int = 42) -> None:
+        self.bot = bot
+        self.chats = chats
+        self.mix = mix
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.chatter = [line for line in CORPUS if line.strip()]
+        # Chatter is only answered when it mentions a symbol the bot knows, ie: not "I paid $5 for this coffee".
+        self.answered = {line for line in self.chatter if router.find_symbols(line, trending_weight=0)}
+
+    def command(self, name: str) -> tuple[str, list]:
+        text = f"/{name} {self.rng.choice(STOCKS + COINS)}"
+        return text, [{"type": "bot_command", "offset": 0, "length": len(name) + 1}]
+
+    def next(self) -> tuple[str | None, Update]:
+        """A random update and the key its reply is tracked by, None if it isn't expected to get a reply."""
+        update_id = next(self.ids)
+        chat = self.rng.randrange(self.chats)
+        user = {"id": 10_000 + chat, "is_bot": False, "first_name": f"User {chat}", "username": f"user{chat}"}
+        kind = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+        if kind == "inline":
+            query = {"id": f"q{update_id}", "from": user, "query": self.rng.choice(INLINE_QUERIES), "offset": ""}
+            return query["id"], Update.de_json({"update_id": update_id, "inline_query": query}, self.bot)
+
+        if kind == "chatter":
+            text, entities = self.rng.choice(self.chatter), []
+        elif kind == "trending":
+            text, entities = "/trending", [{"type": "bot_command", "offset": 0, "length": 9}]
+        else:
+            text, entities = self.command(kind)
+
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": -1_000_000 - chat, "type": "group", "title": f"Chat {chat}"},
+            "from": user,
+            "text": text,
+            "entities": entities,
+        }
+        key = str(update_id) if kind != "chatter" or text in self.answered else None
+        return key, Update.de_json({"update_id": update_id, "message": message}, self.bot)
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1] if len(samples) > 1 else samples[0]
+
+
+async def run_step(application, factory: UpdateFactory, tracker: Tracker, rate: float, duration: float, drain: float) -> dict:
+    """Queues updates at `rate` per second for `duration` seconds, then waits up to `drain` seconds for replies.
+
+    Returns
+    -------
+    dict
+        Offered and achieved rates, latency percentiles in milliseconds, and updates that were never answered.
+    """
+    tracker.reset()
+    total = max(1, int(rate * duration))
+    start = time.perf_counter()
+
+    for i in range(total):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        key, update = factory.next()
+        if key is not None:
+            tracker.queued(key)
+        await application.update_queue.put(update)
+
+    backlog = application.update_queue.qsize()
+    deadline = time.perf_counter() + drain
+    while (tracker.waiting() or application.update_queue.qsize()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    latencies = sorted(tracker.latencies.values())
+    result = {
+        "offered": rate,
+        "achieved": tracker.achieved(rate),
+        "answered": len(latencies),
+        "unanswered": tracker.waiting(),
+        "errors": tracker.errors,
+        "backlog": backlog,
+    }
+    if latencies:
+        result |= {
+            "p50_ms": percentile(latencies, 50) * 1e3,
+            "p90_ms": percentile(latencies, 90) * 1e3,
+            "p99_ms": percentile(latencies, 99) * 1e3,
+            "max_ms": latencies[-1] * 1e3,
+        }
+    return result
+
+
+def saturated(result: dict, slo_ms: float) -> bool:
+    """Replies are lagging once they can't keep up with the rate, or the slowest ones take longer than the SLO."""
+    return (
+        not result["answered"]
+        or result["unanswered"] > 0
+        or result["achieved"] < result["offered"] * 0.9
+        or result["p99_ms"] > slo_ms
+    )
+
+
+def load_bot(mock_api: str | None):
+    """Imports telegram/bot.py with its data providers pointed at the fixtures or the mock API."""
+    os.environ.pop("RATE_LIMIT_DIR", None)
+    os.environ.setdefault("MARKETDATA", "TOKEN")
+    os.environ.setdefault("TELEGRAM", "123456:LOAD-TEST")
+    # Every mention is answered so it can be timed, instead of repeats in a chat being collapsed into one reply.
+    os.environ.setdefault("REPLY_WINDOW", "0")
+
+    if mock_api:
+        base = mock_api.rstrip("/")
+        os.environ["MARKETDATA_URL"] = f"{base}/v1/"
+        os.environ["COINGECKO_URL"] = f"{base}/api/v3"
+        os.environ["SEC_URL"] = f"{base}/files/company_tickers.json"
+        # The license isn't served by the mock API.
+        fixtures.install(("gitlab",))
+    else:
+        fixtures.install(("sec", "marketdata", "coingecko", "uptimerobot", "gitlab"))
+
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "telegram"))
+    bot = importlib.import_module("bot")
+
+    # CoinGecko's rate limit would turn the load test into a measure of sleeping.
+    bucket = bot.s.crypto._get.bucket
+    bucket.rate = bucket.capacity = bucket._tokens = 1e9
+
+    return bot
+
+
+def parse_mix(spec: str | None) -> dict[str, float]:
+    if not spec:
+        return DEFAULT_MIX
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown update kind {kind}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+async def run(args) -> int:
+    bot = load_bot(args.mock_api)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tracker = Tracker()
+    request = StubRequest(tracker, args.bot_latency / 1e3)
+    application = bot.build_application(os.environ["TELEGRAM"], request=request)
+    factory = UpdateFactory(application.bot, bot.s, args.chats, args.mix, args.seed)
+
+    await application.initialize()
+    await application.start()
+
+    try:
+        if args.warmup:
+            await run_step(application, factory, tracker, args.rates[0], args.warmup, args.drain)
+
+        results = []
+        print(
+            f"{'offered/s':>10}{'achieved/s':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+            f"{'backlog':>9}{'lost':>6}{'errors':>8}"
+        )
+        for rate in args.rates:
+            result = await run_step(application, factory, tracker, rate, args.duration, args.drain)
+            results.append(result)
+            print(
+                f"{result['offered']:>10,.1f}{result['achieved']:>12,.1f}{result.get('p50_ms', 0):>10.1f}"
+                f"{result.get('p90_ms', 0):>10.1f}{result.get('p99_ms', 0):>10.1f}{result.get('max_ms', 0):>10.1f}"
+                f"{result['backlog']:>9}{result['unanswered']:>6}{result['errors']:>8}"
+            )
+            if saturated(result, args.slo) and not args.keep_going:
+                break
+    finally:
+        await application.stop()
+        await application.shutdown()
+        bot.renderer.executor.shutdown(cancel_futures=True)
+
+    print(f"\nBot API calls: {dict(sorted(request.calls.items()))}")
+
+    keeping_up = [r for r in results if not saturated(r, args.slo)]
+    if not keeping_up:
+        print(f"Replies lagged at every rate, the bot kept up with less than {args.rates[0]} updates per second.")
+        return 1
+
+    best = max(keeping_up, key=lambda r: r["offered"])
+    print(f"Saturation point: {best['offered']:,.1f} updates per second with a p99 of {best['p99_ms']:.0f} ms.")
+    if len(keeping_up) == len(results):
+        print("Replies never lagged, try higher --rates to find where they do.")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--rates", type=float, nargs="+", default=[5, 10, 20, 40, 80, 160], help="Updates per second for each step."
+    )
+    parser.add_argument("--duration", type=float, default=10, help="Seconds each step queues updates for.")
+    parser.add_argument("--warmup", type=float, default=3, help="Untimed seconds at the first rate to fill caches.")
+    parser.add_argument("--drain", type=float, default=30, help="Seconds to wait for replies after each step.")
+    parser.add_argument("--chats", type=int, default=5000, help="Number of different chats updates come from.")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="ie: chatter=60,chart=8,intra=8,trending=4,inline=20")
+    parser.add_argument("--slo", type=float, default=2000, help="p99 latency in ms above which replies are lagging.")
+    parser.add_argument("--bot-latency", type=float, default=0, help="Milliseconds each Bot API call takes.")
+    parser.add_argument("--mock-api", help="Base URL of a running benchmarks.mock_api instead of in process fixtures.")
+    parser.add_argument("--keep-going", action="store_true", help="Run every rate instead of stopping once replies lag.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Keep snapshots from a real deployment out of the load test.
+    snapshots = os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="stockbot-load-")
+    try:
+        return asyncio.run(run(args))
+    finally:
+        shutil.rmtree(snapshots, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""Local stand in for MarketData.app, CoinGecko and the SEC ticker list, with injectable latency and faults.
+
+Answers from the recorded payloads in `benchmarks.fixtures`. Point the bots at it with:
+    MARKETDATA_URL=http://127.0.0.1:8080/v1
+    COINGECKO_URL=http://127.0.0.1:8080/api/v3
+    SEC_URL=http://127.0.0.1:8080/files/company_tickers.json
+
+Run from the root of the repo, ie: slow responses with a 5 second burst of 429s every minute and 1% server errors:
+    python -m benchmarks.mock_api --latency lognormal:80,0.6 --burst-every 60 --burst-seconds 5 --error-rate 0.01
+
+The faults can be changed while it runs:
+    curl -X POST localhost:8080/_faults -d '{"error_rate": 0.5}'
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from benchmarks.fixtures import FixtureAPI
+
+log = logging.getLogger(__name__)
+
+
+class Faults:
+    """
+    What goes wrong with responses, shared by every request the server handles.
+
+    latency : str
+        Delay before answering in milliseconds, one of `none`, `fixed:MS`, `uniform:LOW,HIGH`,
+            `exponential:MEAN` or `lognormal:MEDIAN,SIGMA`.
+    error_rate : float
+        Fraction of requests answered with a random 500, 502, 503 or 504.
+    malformed_rate : float
+        Fraction of requests answered 200 with JSON that is cut off partway through.
+    rate_429 : float
+        Fraction of requests answered 429 outside of bursts.
+    burst_every, burst_seconds : float
+        Every `burst_every` seconds, every request is answered 429 for `burst_seconds`, like a shared rate limit
+            being exhausted. Off when `burst_every` is 0.
+    paths : str
+        Faults only apply to paths starting with this, ie: /api/v3 for just CoinGecko.
+    """
+
+    fields = ("latency", "error_rate", "malformed_rate", "rate_429", "burst_every", "burst_seconds", "paths")
+
+    def __init__(
+        self,
+        latency: str = "none",
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        rate_429: float = 0.0,
+        burst_every: float = 0.0,
+        burst_seconds: float = 0.0,
+        paths: str = "/",
+        seed: int | None = None,
+    ) -> None:
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.started = time.monotonic()
+        self.update(
+            latency=latency,
+            error_rate=error_rate,
+            malformed_rate=malformed_rate,
+            rate_429=rate_429,
+            burst_every=burst_every,
+            burst_seconds=burst_seconds,
+            paths=paths,
+        )
+
+    def update(self, **config) -> None:
+        unknown = set(config) - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unknown faults: {', '.join(sorted(unknown))}")
+
+        delay = self.parse_latency(config.get("latency", getattr(self, "latency", "none")))
+        with self.lock:
+            for key, value in config.items():
+                setattr(self, key, value if key in ("latency", "paths") else float(value))
+            self.delay = delay
+
+    @staticmethod
+    def parse_latency(spec: str):
+        """Turns a latency spec in milliseconds into a function of a Random that returns seconds."""
+        name, _, args = spec.partition(":")
+        try:
+            values = [float(v) for v in args.split(",")] if args else []
+        except ValueError:
+            values = None
+
+        match name, values:
+            case "none", []:
+                return lambda rng: 0.0
+            case "fixed", [ms]:
+                return lambda rng: ms / 1e3
+            case "uniform", [low, high]:
+                return lambda rng: rng.uniform(low, high) / 1e3
+            case "exponential", [mean] if mean > 0:
+                return lambda rng: rng.expovariate(1 / mean) / 1e3
+            case "lognormal", [median, sigma]:
+                return lambda rng: median * rng.lognormvariate(0, sigma) / 1e3
+        raise ValueError(f"Invalid latency {spec}")
+
+    def config(self) -> dict:
+        with self.lock:
+            return {key: getattr(self, key) for key in self.fields}
+
+    def pick(self, path: str) -> tuple[float, str | None]:
+        """Chooses the delay and fault for a request.
+
+        Returns
+        -------
+        tuple[float, str | None]
+            Seconds to wait, and the status code to fail with, malformed, or None for a normal response.
+        """
+        with self.lock:
+            if not path.startswith(self.paths):
+                return 0.0, None
+
+            delay = self.delay(self.rng)
+
+            if self.burst_every and (time.monotonic() - self.started) % self.burst_every < self.burst_seconds:
+                return delay, "429"
+
+            roll = self.rng.random()
+            for fault, rate in (("429", self.rate_429), ("5xx", self.error_rate), ("malformed", self.malformed_rate)):
+                if roll < rate:
+                    return delay, self.rng.choice(("500", "502", "503", "504")) if fault == "5xx" else fault
+                roll -= rate
+
+            return delay, None
+
+
+def make_handler(api: FixtureAPI, faults: Faults, stats: dict):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, status: int, body: bytes, headers: dict | None = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path = unquote(url.path)
+
+            if path == "/_faults":
+                self.reply(200, json.dumps(faults.config() | {"responses": stats}).encode())
+                return
+
+            delay, fault = faults.pick(path)
+            if delay:
+                time.sleep(delay)
+
+            match fault:
+                case "429":
+                    status, body, headers = (
+                        429,
+                        b'{"status":{"error_code":429,"error_message":"Too Many Requests"}}',
+                        {"Retry-After": "5"},
+                    )
+                case "500" | "502" | "503" | "504":
+                    status, body, headers = int(fault), b'{"error":"Injected fault"}', {}
+                case _:
+                    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    status, body = api.handle(path, query)
+                    headers = {}
+                    if fault == "malformed" and status == 200:
+                        body = body[: max(1, len(body) // 2)]
+
+            with faults.lock:
+                key = fault or str(status)
+                stats[key] = stats.get(key, 0) + 1
+
+            self.reply(status, body, headers)
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/_faults":
+                self.reply(404, b'{"error":"Not Found"}')
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                faults.update(**json.loads(self.rfile.read(length) or b"{}"))
+            except (ValueError, TypeError) as e:
+                self.reply(400, json.dumps({"error": str(e)}).encode())
+                return
+
+            log.info(f"Faults changed to {faults.config()}")
+            self.reply(200, json.dumps(faults.config()).encode())
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, faults: Faults | None = None) -> ThreadingHTTPServer:
+    """Starts the mock API on a background thread, port 0 picks a free port.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        Running server, stop it with `shutdown`.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(FixtureAPI(), faults or Faults(), {}))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", default="none", help="none, fixed:MS, uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 5xx.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of requests answered with cut off JSON.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered 429.")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Seconds between bursts of 429s.")
+    parser.add_argument("--burst-seconds", type=float, default=0.0, help="Length of each burst of 429s.")
+    parser.add_argument("--paths", default="/", help="Only inject faults into paths starting with this, ie: /api/v3")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    faults = Faults(
+        args.latency,
+        args.error_rate,
+        args.malformed_rate,
+        args.rate_429,
+        args.burst_every,
+        args.burst_seconds,
+        args.paths,
+        args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(FixtureAPI(), faults, {}))
+    base = f"http://{args.host}:{server.server_address[1]}"
+    log.info(f"Mock API listening on {base}")
+    log.info(f"MARKETDATA_URL={base}/v1 COINGECKO_URL={base}/api/v3 SEC_URL={base}/files/company_tickers.json")
+    log.info(f"Faults: {faults.config()}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
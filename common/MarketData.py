@@ -1,17 +1,25 @@
 import datetime as dt
 import logging
 import os
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
 import humanize
 import pandas as pd
 import pytz
 import requests as r
-import schedule
+from cachetools import LRUCache, TLRUCache
 
-
-from common.Symbol import Stock
+from common.candle_store import CandleStore
+from common.metrics import CACHE_REQUESTS, UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from common.scheduler import scheduler
+from common.sessions import get_session
+from common.shared_cache import shared_cache
+from common.snapshot import Snapshot
+from common.Symbol import Stock, registry
+from common.utilities import SingleFlight, request_key
 
 log = logging.getLogger(__name__)
 
@@ -21,14 +29,22 @@ class MarketData:
     Functions for finding stock market information about symbols from MarkData.app
     """
 
-    SYMBOL_REGEX = "[$]([a-zA-Z]{1,4})"
+    symbol_list: Dict[str, Stock] = {}
 
-    symbol_list: Dict[str, Dict] = {}
-    charts: Dict[Stock, pd.DataFrame] = {}
+    # Can be pointed at a local stand in, ie: python -m benchmarks.mock_api
+    base_url = os.environ.get("MARKETDATA_URL", "https://api.marketdata.app/v1").rstrip("/") + "/"
+    sec_url = os.environ.get("SEC_URL", "https://www.sec.gov/files/company_tickers.json")
 
     openTime = dt.time(hour=9, minute=30, second=0)
+    closeTime = dt.time(hour=16, minute=0, second=0)
+    preMarketTime = dt.time(hour=4, minute=0, second=0)
+    afterHoursTime = dt.time(hour=20, minute=0, second=0)
     marketTimeZone = pytz.timezone("US/Eastern")
 
+    # How long a quote is reused for during each market session, in seconds.
+    # When the market is closed quotes are kept until the next pre-market open.
+    quote_ttl = {"regular": 5, "extended": 60}
+
     def __init__(self) -> None:
         """Creates a Symbol Object
 
@@ -49,17 +65,49 @@ class MarketData:
             log.warning("Use this affiliate link so that the bot can stay free:")
             log.warning("https://dashboard.marketdata.app/marketdata/aff/go/misterbiggs?keyword=repo")
 
-        if self.MARKETDATA_TOKEN != "":
-            schedule.every().day.do(self.clear_charts)
+        self.flights = SingleFlight("marketdata")
+
+        self.quote_cache = TLRUCache(maxsize=int(os.environ.get("QUOTE_CACHE_SIZE", 2048)), ttu=self.quote_expiry)
+        self.quote_lock = threading.Lock()
+
+        # Intraday candles are refreshed every minute, daily candles every hour.
+        self.candles = CandleStore({"15": 60, "daily": 3600}, name="marketdata_candles")
 
-        self.get_symbol_list()
-        schedule.every().day.do(self.get_symbol_list)
+        # Intraday candles for each symbol since the open, topped up with only the newest bars.
+        self.intraday = LRUCache(maxsize=1024)
+        self.intraday_lock = threading.Lock()
+
+        # Used to fan out quote requests when a bulk quote isn't available.
+        self.executor = ThreadPoolExecutor(max_workers=int(os.environ.get("QUOTE_WORKERS", 8)), thread_name_prefix="quotes")
+
+        self.symbol_snapshot = Snapshot("sec_tickers")
+        self.load_symbol_list()
+        scheduler.every(24 * 3600, self.get_symbol_list, name="stock_symbol_list")
 
     def get(self, endpoint, params=None, timeout=10, headers=None) -> dict:
-        url = "https://api.marketdata.app/v1/" + endpoint
+        """Makes a request to MarketData.app, sharing the response with identical requests that are already in flight.
+
+        Parameters
+        ----------
+        endpoint : str
+            Path of the endpoint, ie: stocks/quotes/TSLA/
+        params : dict, optional
+            Query parameters, the token is added automatically.
+
+        Returns
+        -------
+        dict
+            Parsed JSON response, empty if the request failed.
+        """
+        return self.flights.do(request_key(endpoint, params), self._get, endpoint, params, timeout, headers)
+
+    def _get(self, endpoint, params=None, timeout=10, headers=None) -> dict:
+        url = self.base_url + endpoint
 
         if params is None:
             params = {}
+        else:
+            params = params.copy()
 
         # set token param if it wasn't passed.
         params["token"] = self.MARKETDATA_TOKEN
@@ -70,11 +118,15 @@ class MarketData:
 
         if headers is None:
             headers = {}
-        headers = {"User-Agent": "Simple Stock Bot anson@ansonbiggs.com"} | headers
 
-        resp = r.get(url, params=params, timeout=timeout, headers=headers)
-
-        logging.error(resp.headers.items())
+        label = self.endpoint_label(endpoint)
+        with UPSTREAM_SECONDS.time(provider="marketdata", endpoint=label):
+            try:
+                resp = get_session("marketdata").get(url, params=params, timeout=timeout, headers=headers)
+            except r.exceptions.RequestException:
+                UPSTREAM_RESPONSES.inc(provider="marketdata", endpoint=label, status="error")
+                raise
+        UPSTREAM_RESPONSES.inc(provider="marketdata", endpoint=label, status=resp.status_code)
 
         # Make sure API returned a proper status code
         try:
@@ -101,42 +153,52 @@ class MarketData:
 
         return {}
 
-    def symbol_id(self, symbol: str) -> Dict[str, Dict]:
-        return self.symbol_list.get(symbol.upper(), None)
+    @staticmethod
+    def endpoint_label(endpoint: str) -> str:
+        """Endpoint with the symbol removed so metrics aren't split up by symbol, ie: stocks/candles/15/TSLA -> stocks/candles/15"""
+        parts = endpoint.strip("/").split("/")
+        return "/".join(parts[:3] if parts[:2] == ["stocks", "candles"] else parts[:2])
+
+    def lookup(self, symbol: str) -> Stock | None:
+        """Finds the shared Stock for a ticker, ie: tsla. None if the ticker isn't listed."""
+        symbol = symbol.upper()
+        # The SEC list writes share classes with a dash, ie: BRK-B
+        return self.symbol_list.get(symbol) or self.symbol_list.get(symbol.replace(".", "-"))
+
+    def load_symbol_list(self) -> None:
+        """Loads the symbol list from the local snapshot so the bot can start right away,
+        then checks for a newer list in the background. Only blocks on the download if there is no snapshot.
+        """
+        if (sec_data := self.symbol_snapshot.load()) is not None:
+            self.set_symbol_list(sec_data)
+            threading.Thread(target=self.get_symbol_list, name="sec-symbols", daemon=True).start()
+        else:
+            self.get_symbol_list()
 
     def get_symbol_list(self):
         # Doesn't use `self.get()` since needs are much different
-        sec_resp = r.get(
-            "https://www.sec.gov/files/company_tickers.json",
-            headers={
-                "User-Agent": "Simple Stock Bot anson@ansonbiggs.com",
-                "Accept-Encoding": "gzip, deflate",
-                "Host": "www.sec.gov",
-            },
+        sec_data = self.symbol_snapshot.refresh(
+            lambda headers: get_session("sec").get(
+                self.sec_url,
+                headers=headers,
+                timeout=30,
+            )
         )
-        sec_resp.raise_for_status()
-        sec_data = sec_resp.json()
 
-        for rank, ticker_info in sec_data.items():
-            self.symbol_list[ticker_info["ticker"]] = {
-                "ticker": ticker_info["ticker"],
-                "title": ticker_info["title"],
-                "mkt_cap_rank": rank,
-            }
+        if sec_data is not None:
+            self.set_symbol_list(sec_data)
 
-    def clear_charts(self) -> None:
-        """
-        Clears cache of chart data.
-        Charts are cached so that only 1 API call per 24 hours is needed since the
-            chart data is expensive and a large download.
-        """
-        self.charts = {}
+    def set_symbol_list(self, sec_data: dict) -> None:
+        # Build a new dict and swap it in so lookups never see a partially loaded list.
+        self.symbol_list = registry.load(
+            Stock, (Stock(info["ticker"], info["title"], int(rank)) for rank, info in sec_data.items())
+        )
 
     def status(self) -> str:
         # TODO: At the moment this API is poorly documented, this function likely needs to be revisited later.
 
         try:
-            status = r.get(
+            status = get_session("uptimerobot").get(
                 "https://stats.uptimerobot.com/api/getMonitorList/6Kv3zIow0A",
                 timeout=5,
             )
@@ -155,12 +217,150 @@ class MarketData:
         else:
             return f"MarketData.app is currently reporting the following status: {statusJSON['status']}"
 
-    def price_reply(self, symbol: Stock) -> str:
-        """Returns price movement of Stock for the last market day, or after hours.
+    def market_session(self, now: dt.datetime | None = None) -> str:
+        """Finds which trading session the US stock market is in.
+
+        Parameters
+        ----------
+        now : dt.datetime, optional
+            Time to check, defaults to the current time.
+
+        Returns
+        -------
+        str
+            "regular", "extended" for pre-market and after hours, or "closed".
+        """
+        if now is None:
+            now = dt.datetime.now(self.marketTimeZone)
+        else:
+            now = now.astimezone(self.marketTimeZone)
+
+        if now.weekday() >= 5:
+            return "closed"
+        if self.openTime <= now.time() < self.closeTime:
+            return "regular"
+        if self.preMarketTime <= now.time() < self.afterHoursTime:
+            return "extended"
+        return "closed"
+
+    def seconds_until_premarket(self, now: dt.datetime | None = None) -> float:
+        """Seconds until the next weekday pre-market open."""
+        if now is None:
+            now = dt.datetime.now(self.marketTimeZone)
+        else:
+            now = now.astimezone(self.marketTimeZone)
+
+        day = now.date()
+        if now.time() >= self.preMarketTime:
+            day += dt.timedelta(days=1)
+        while day.weekday() >= 5:
+            day += dt.timedelta(days=1)
+
+        next_open = self.marketTimeZone.localize(dt.datetime.combine(day, self.preMarketTime))
+        return (next_open - now).total_seconds()
+
+    def quote_expiry(self, _key, _value, now: float) -> float:
+        """Time-to-use function for the quote cache, quotes live longer the less the market is trading."""
+        session = self.market_session()
+        if session == "closed":
+            return now + self.seconds_until_premarket()
+        return now + self.quote_ttl[session]
+
+    def quote(self, symbol: Stock) -> dict:
+        """Gets the latest quote for a stock. Quotes are cached for a length of time based on the market session,
+            so price, spark, and chart caption lookups for the same symbol only make one API call.
+
+        Parameters
+        ----------
+        symbol : Stock
+
+        Returns
+        -------
+        dict
+            Quote response from MarketData.app, empty if the quote failed.
+        """
+        with self.quote_lock:
+            try:
+                quoteResp = self.quote_cache[symbol.symbol]
+                CACHE_REQUESTS.inc(cache="quotes", result="hit")
+                return quoteResp
+            except KeyError:
+                CACHE_REQUESTS.inc(cache="quotes", result="miss")
+
+        # Quotes from the sidecar aren't kept in memory, since they may be close to expiring.
+        if (quoteResp := shared_cache.get_json(f"quote:{symbol.symbol}")) is not None:
+            return quoteResp
+
+        return self.fetch_quote(symbol)
+
+    def fetch_quote(self, symbol: Stock) -> dict:
+        """Downloads a quote, skipping the cache, and caches it."""
+        if quoteResp := self.get(f"stocks/quotes/{symbol.symbol}/"):
+            with self.quote_lock:
+                self.quote_cache[symbol.symbol] = quoteResp
+            self.share_quote(symbol.symbol, quoteResp)
+
+        return quoteResp
+
+    def share_quote(self, ticker: str, quoteResp: dict) -> None:
+        """Puts a quote in the cache sidecar for as long as it would be kept in memory."""
+        shared_cache.set_json(f"quote:{ticker}", quoteResp, self.quote_expiry(ticker, quoteResp, 0))
+
+    def batch_quote(self, symbols: list[Stock]) -> Dict[str, dict]:
+        """Gets quotes for many stocks at once. Cached quotes are reused and the rest are fetched in a single
+            bulk request, falling back to fetching them concurrently if the bulk request fails.
+
+        Parameters
+        ----------
+        symbols : list[Stock]
+
+        Returns
+        -------
+        Dict[str, dict]
+            Quote for each ticker that returned one, in the same format as `quote`.
+        """
+        quotes = {}
+        with self.quote_lock:
+            for symbol in symbols:
+                if (cached := self.quote_cache.get(symbol.symbol)) is not None:
+                    quotes[symbol.symbol] = cached
+                    CACHE_REQUESTS.inc(cache="quotes", result="hit")
+                else:
+                    CACHE_REQUESTS.inc(cache="quotes", result="miss")
+
+        for ticker in dict.fromkeys(s.symbol for s in symbols if s.symbol not in quotes):
+            if (shared := shared_cache.get_json(f"quote:{ticker}")) is not None:
+                quotes[ticker] = shared
+
+        missing = list(dict.fromkeys(s.symbol for s in symbols if s.symbol not in quotes))
+        if not missing:
+            return quotes
+
+        if len(missing) > 1 and (bulkResp := self.get("stocks/bulkquotes/", params={"symbols": ",".join(missing)})):
+            columns = {k: v for k, v in bulkResp.items() if isinstance(v, list)}
+            with self.quote_lock:
+                for i, ticker in enumerate(columns.get("symbol", [])):
+                    quoteResp = {"s": "ok"} | {k: [v[i]] for k, v in columns.items()}
+                    self.quote_cache[ticker] = quoteResp
+                    quotes[ticker] = quoteResp
+            for ticker in columns.get("symbol", []):
+                self.share_quote(ticker, quotes[ticker])
+
+        if missing := [s for s in symbols if s.symbol not in quotes]:
+            for symbol, quoteResp in zip(missing, self.executor.map(self.fetch_quote, missing)):
+                if quoteResp:
+                    quotes[symbol.symbol] = quoteResp
+
+        return quotes
+
+    def price_message(self, symbol: Stock, quoteResp: dict) -> str:
+        """Formats a quote into a human readable reply.
 
         Parameters
         ----------
         symbol : Stock
+        quoteResp : dict
+            Quote from `quote` or `batch_quote`, may be empty.
 
         Returns
         -------
@@ -168,7 +368,7 @@ class MarketData:
             Formatted markdown
         """
 
-        if quoteResp := self.get(f"stocks/quotes/{symbol.symbol}/"):
+        if quoteResp:
             price = round(quoteResp["last"][0], 2)
 
             try:
@@ -189,8 +389,37 @@ class MarketData:
         else:
             return f"Getting a quote for {symbol} encountered an error."
 
+    def price_reply(self, symbol: Stock) -> str:
+        """Returns price movement of Stock for the last market day, or after hours.
+
+        Parameters
+        ----------
+        symbol : Stock
+
+        Returns
+        -------
+        str
+            Formatted markdown
+        """
+        return self.price_message(symbol, self.quote(symbol))
+
+    def batch_price(self, symbols: list[Stock]) -> list[str]:
+        """Returns price movement for a list of stocks using as few API calls as possible.
+
+        Parameters
+        ----------
+        symbols : list[Stock]
+
+        Returns
+        -------
+        list[str]
+            One formatted markdown reply for each stock, in the same order they were passed in.
+        """
+        quotes = self.batch_quote(symbols)
+        return [self.price_message(symbol, quotes.get(symbol.symbol, {})) for symbol in symbols]
+
     def spark_reply(self, symbol: Stock) -> str:
-        if quoteResp := self.get(f"stocks/quotes/{symbol}/"):
+        if quoteResp := self.quote(symbol):
             try:
                 changePercent = round(quoteResp["changepct"][0], 2)
                 return f"`{symbol.tag}`: {changePercent}%"
@@ -200,8 +429,8 @@ class MarketData:
         return f"`{symbol.tag}`"
 
     def intra_reply(self, symbol: Stock) -> pd.DataFrame:
-        """Returns price data for a symbol of the past month up until the previous trading days close.
-        Also caches multiple requests made in the same day.
+        """Returns price data for a symbol since the last market open.
+        Cached for a minute so that repeated requests don't download the candles again.
 
         Parameters
         ----------
@@ -213,53 +442,77 @@ class MarketData:
         pd.DataFrame
             Returns a timeseries dataframe with high, low, and volume data if its available. Otherwise returns empty pd.DataFrame.
         """
-        schedule.run_pending()
+        return self.candles.get_or_fetch(symbol, "15", "intra", lambda: self.fetch_intra(symbol))
 
-        try:
-            return self.charts[symbol.id.upper()]
-        except KeyError:
-            pass
+    def fetch_intra(self, symbol: Stock) -> pd.DataFrame:
+        """Gets 15 minute candles since the last market open, including extended hours.
 
+        Candles are kept in a per symbol buffer, so each call only downloads the bars since the last one it has.
+            The last bar is downloaded again since it may have still been forming. Bars from before the current
+            session are dropped, so the buffer rolls over at the open and never grows past a day of bars.
+        """
         resolution = "15"  # minutes
         now = dt.datetime.now(self.marketTimeZone)
 
         if self.openTime < now.time():
-            startTime = now.replace(hour=9, minute=30)
+            startTime = now.replace(hour=9, minute=30, second=0, microsecond=0)
         else:
             startTime = now - dt.timedelta(days=1)
 
-        if data := self.get(
+        with self.intraday_lock:
+            covered_from, buffered = self.intraday.get(symbol.symbol, (None, None))
+
+        if buffered is not None and not buffered.empty and covered_from <= startTime:
+            fetch_from = buffered.last_valid_index()
+        else:
+            fetch_from, buffered = startTime, None
+
+        data = self.get(
             f"stocks/candles/{resolution}/{symbol}",
             params={
-                "from": startTime.timestamp(),
+                "from": fetch_from.timestamp(),
                 "to": now.timestamp(),
                 "extended": True,
             },
-        ):
+        )
+
+        if data.get("s") == "ok":
             data.pop("s")
             df = pd.DataFrame(data)
-            df["t"] = pd.to_datetime(df["t"], unit="s", utc=True)
-            df.set_index("t", inplace=True)
+            if not df.empty:
+                df["t"] = pd.to_datetime(df["t"], unit="s", utc=True)
+                df.set_index("t", inplace=True)
+
+                df.rename(
+                    columns={
+                        "o": "Open",
+                        "h": "High",
+                        "l": "Low",
+                        "c": "Close",
+                        "v": "Volume",
+                    },
+                    inplace=True,
+                )
+        elif buffered is None:
+            return pd.DataFrame()
+        else:
+            df = pd.DataFrame()
 
-            df.rename(
-                columns={
-                    "o": "Open",
-                    "h": "High",
-                    "l": "Low",
-                    "c": "Close",
-                    "v": "Volume",
-                },
-                inplace=True,
-            )
+        if buffered is not None:
+            df = pd.concat([buffered, df])
+            df = df[~df.index.duplicated(keep="last")]
 
-            self.charts[symbol.id.upper()] = df
-            return df
+        if not df.empty:
+            df = df[df.index >= startTime]
 
-        return pd.DataFrame()
+        with self.intraday_lock:
+            self.intraday[symbol.symbol] = (startTime, df)
+
+        return df
 
     def chart_reply(self, symbol: Stock) -> pd.DataFrame:
         """Returns price data for a symbol of the past month up until the previous trading days close.
-        Also caches multiple requests made in the same day.
+        Cached for an hour so that repeated requests don't download the candles again.
 
         Parameters
         ----------
@@ -271,13 +524,10 @@ class MarketData:
         pd.DataFrame
             Returns a timeseries dataframe with high, low, and volume data if its available. Otherwise returns empty pd.DataFrame.
         """
-        schedule.run_pending()
-
-        try:
-            return self.charts[symbol.id.upper()]
-        except KeyError:
-            pass
+        return self.candles.get_or_fetch(symbol, "daily", "1M", lambda: self.fetch_chart(symbol))
 
+    def fetch_chart(self, symbol: Stock) -> pd.DataFrame:
+        """Downloads daily candles for the past month."""
         to_date = dt.datetime.today().strftime("%Y-%m-%d")
         from_date = (dt.datetime.today() - dt.timedelta(days=30)).strftime("%Y-%m-%d")
         resultion = "daily"
@@ -306,7 +556,6 @@ class MarketData:
                 inplace=True,
             )
 
-            self.charts[symbol.id.upper()] = df
             return df
 
         return pd.DataFrame()
@@ -1,6 +1,5 @@
-import logging
-
-import pandas as pd
+import threading
+from typing import Dict, Iterable
 
 
 class Symbol:
@@ -9,16 +8,35 @@ class Symbol:
     id: What the api expects. ie tsla or bitcoin
     name: Human readable. ie Tesla or Bitcoin
     tag: Uppercase tag to call the symbol. ie $TSLA or $$BTC
+
+    Symbols are immutable and compare equal by type and id, so they can be used as cache keys.
+        One instance of each is shared through `registry`, see `SymbolRegistry`.
     """
 
+    __slots__ = ("symbol", "id", "name", "tag", "_hash")
+
     currency = "usd"
-    pass
 
-    def __init__(self, symbol) -> None:
-        self.symbol = symbol
-        self.id = symbol
-        self.name = symbol
-        self.tag = "$" + symbol
+    def __init__(self, symbol: str, id: str | None = None, name: str | None = None, tag: str | None = None) -> None:
+        self._set(symbol=symbol, id=id or symbol, name=name or symbol, tag=tag or "$" + symbol)
+
+    def _set(self, **fields) -> None:
+        for field, value in fields.items():
+            object.__setattr__(self, field, value)
+        object.__setattr__(self, "_hash", hash((self.__class__.__name__, self.id)))
+
+    def args(self) -> tuple:
+        """Arguments that construct an equal symbol."""
+        return (self.symbol, self.id, self.name, self.tag)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return (self.__class__, self.args())
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} instance of {self.id} at {id(self)}>"
@@ -26,30 +44,90 @@ class Symbol:
     def __str__(self) -> str:
         return self.id
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Symbol):
+            return NotImplemented
+        return self.__class__ is other.__class__ and self.id == other.id
+
     def __hash__(self):
-        return hash(self.id)
+        return self._hash
 
 
 class Stock(Symbol):
     """Stock Market Object. Gets data from MarketData"""
 
-    def __init__(self, symbol_info: dict) -> None:
-        self.symbol = symbol_info["ticker"]
-        self.id = symbol_info["ticker"]
-        self.name = symbol_info["title"]
-        self.tag = "$" + symbol_info["ticker"]
-        self.market_cap_rank = symbol_info["mkt_cap_rank"]
+    __slots__ = ("market_cap_rank",)
+
+    def __init__(self, ticker: str, name: str, market_cap_rank: int | None = None) -> None:
+        self._set(symbol=ticker, id=ticker, name=name, tag="$" + ticker, market_cap_rank=market_cap_rank)
+
+    def args(self) -> tuple:
+        return (self.symbol, self.name, self.market_cap_rank)
 
 
 class Coin(Symbol):
     """Cryptocurrency Object. Gets data from CoinGecko."""
 
-    def __init__(self, symbol: pd.DataFrame) -> None:
-        if len(symbol) > 1:
-            logging.info(f"Crypto with shared id:\n\t{symbol.id}")
-            symbol = symbol.head(1)
+    __slots__ = ()
+
+    def __init__(self, id: str, symbol: str, name: str) -> None:
+        self._set(symbol=symbol, id=id, name=name, tag="$$" + symbol.upper())
+
+    def args(self) -> tuple:
+        return (self.id, self.symbol, self.name)
+
+
+class SymbolRegistry:
+    """
+    Shared instance of every known symbol.
+
+    Symbol lists are loaded through `load`, which keeps the existing instance of each symbol that hasn't changed,
+        so the symbols found in messages are the same objects held by caches and don't need to be built per message.
+    """
+
+    def __init__(self) -> None:
+        # (class, id): symbol
+        self.symbols: Dict[tuple[type, str], Symbol] = {}
+        self.lock = threading.Lock()
+
+    def load(self, cls: type, symbols: Iterable[Symbol]) -> Dict[str, Symbol]:
+        """Replaces every symbol of a class with a freshly loaded list, forgetting ones that are no longer listed.
+
+        Parameters
+        ----------
+        cls : type
+            Class of the symbols, ie: Stock
+        symbols : Iterable[Symbol]
+            Every symbol of that class, later ones with the same id are ignored.
+
+        Returns
+        -------
+        Dict[str, Symbol]
+            Shared instance of each symbol by id, in the order they were listed.
+        """
+        loaded: Dict[str, Symbol] = {}
+        for symbol in symbols:
+            if symbol.id not in loaded:
+                loaded[symbol.id] = symbol
+
+        with self.lock:
+            current = {key[1]: symbol for key, symbol in self.symbols.items() if key[0] is cls}
+            for id, symbol in loaded.items():
+                existing = current.get(id)
+                if existing is not None and existing.args() == symbol.args():
+                    loaded[id] = existing
+
+            self.symbols = {key: symbol for key, symbol in self.symbols.items() if key[0] is not cls}
+            self.symbols.update(((cls, id), symbol) for id, symbol in loaded.items())
+
+        return loaded
+
+    def get(self, cls: type, id: str) -> Symbol | None:
+        return self.symbols.get((cls, id))
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
 
-        self.symbol = symbol.symbol.values[0]
-        self.id = symbol.id.values[0]
-        self.name = symbol.name.values[0]
-        self.tag = symbol.type_id.values[0].upper()
+# Shared by both data providers.
+registry = SymbolRegistry()
@@ -0,0 +1,171 @@
+"""Cache sidecar shared by the Telegram and Discord bots, see `common.shared_cache` for the client and protocol.
+
+Listens on the SHARED_CACHE address, ie: from the root of the repo:
+    SHARED_CACHE=unix:/tmp/stockbot-cache.sock python -m common.cache_server
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import OrderedDict
+
+from common.shared_cache import FRAME, MAX_VALUE_BYTES, pack, parse_address
+
+log = logging.getLogger(__name__)
+
+
+class Store:
+    """Values with a time to live, capped by their total size in bytes and evicting the least recently used first."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        # key: (expires, value)
+        self.entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, now: float | None = None) -> bytes | None:
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        if len(value) > self.max_bytes:
+            return
+
+        self.delete(key)
+        self.entries[key] = (now + ttl, value)
+        self.bytes += len(value)
+
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def delete(self, key: str) -> None:
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.bytes -= len(entry[1])
+
+    def expire(self, now: float | None = None) -> int:
+        """Drops expired entries, returning how many were dropped."""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, (expires, _) in self.entries.items() if expires <= now]
+        for key in expired:
+            self.delete(key)
+        return len(expired)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+class CacheServer:
+    """Answers get, set, delete, and stats requests from the bots on a Unix or TCP socket."""
+
+    def __init__(self, address: str, max_bytes: int) -> None:
+        self.address = address
+        self.store = Store(max_bytes)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header_len, body_len = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if body_len > MAX_VALUE_BYTES:
+                    log.warning(f"Dropping client that sent a {body_len} byte value.")
+                    break
+                header = json.loads(await reader.readexactly(header_len))
+                body = await reader.readexactly(body_len)
+
+                writer.write(self.respond(header, body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            log.warning(f"Dropping client that sent an invalid request: {e}")
+        finally:
+            writer.close()
+
+    def respond(self, header: dict, body: bytes) -> bytes:
+        try:
+            match header.get("op"):
+                case "get":
+                    value = self.store.get(header["key"])
+                    return pack({"hit": value is not None}, value or b"")
+                case "set":
+                    self.store.set(header["key"], body, float(header["ttl"]))
+                    return pack({"ok": True})
+                case "delete":
+                    self.store.delete(header["key"])
+                    return pack({"ok": True})
+                case "stats":
+                    return pack(self.store.stats())
+                case op:
+                    return pack({"error": f"Unknown op {op}"})
+        # Headers that aren't objects, or are missing or have the wrong type of fields.
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            log.warning(f"Invalid request {header}: {e!r}")
+            return pack({"error": f"Invalid request: {e!r}"})
+
+    async def expire_forever(self, interval: float = 60) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if expired := self.store.expire():
+                log.info(f"Expired {expired} entries, {self.store.stats()}")
+
+    async def serve(self) -> None:
+        family, sockaddr = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            server = await asyncio.start_unix_server(self.handle, sockaddr)
+            os.chmod(sockaddr, 0o666)
+        else:
+            server = await asyncio.start_server(self.handle, *sockaddr)
+
+        log.info(f"Cache sidecar listening on {self.address} with {self.store.max_bytes / 1024**2:.0f}MB.")
+        expiry = asyncio.create_task(self.expire_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=os.environ.get("SHARED_CACHE", "0.0.0.0:7380"))
+    parser.add_argument(
+        "--max-bytes", type=int, default=int(os.environ.get("SHARED_CACHE_BYTES", 256 * 1024 * 1024)), help="Memory cap."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    try:
+        asyncio.run(CacheServer(args.address, args.max_bytes).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Bounded cache of candle data used to draw charts.
+"""
+
+import logging
+import os
+import threading
+from typing import Callable, Dict
+
+import pandas as pd
+from cachetools import TLRUCache
+
+from common.metrics import CACHE_REQUESTS
+from common.shared_cache import shared_cache
+
+log = logging.getLogger(__name__)
+
+
+class CandleStore:
+    """
+    Caches candle DataFrames by (symbol, resolution, range).
+
+    Each resolution has its own time to live since fine grained candles go stale much faster than daily ones.
+        The cache is capped by the memory used by the DataFrames and evicts the least recently used first.
+        Candles missing from memory are looked for in the cache sidecar before being downloaded, see `common.shared_cache`.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_bytes: int | None = None, name: str = "candles") -> None:
+        """
+        Parameters
+        ----------
+        ttls : Dict[str, float]
+            Seconds candles of each resolution are kept for, ie: {"15": 60, "daily": 3600}
+        max_bytes : int, optional
+            Memory cap, defaults to the CANDLE_CACHE_BYTES environment variable or 32MB.
+        name : str, optional
+            Name the cache is reported under in metrics.
+        """
+        self.ttls = ttls
+        self.name = name
+        max_bytes = max_bytes or int(os.environ.get("CANDLE_CACHE_BYTES", 32 * 1024 * 1024))
+
+        self.cache = TLRUCache(maxsize=max_bytes, ttu=self.expiry, getsizeof=self.size)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def expiry(self, key: tuple, _value, now: float) -> float:
+        return now + self.ttls[key[1]]
+
+    @staticmethod
+    def size(df: pd.DataFrame) -> int:
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    def get(self, symbol, resolution: str, range: str) -> pd.DataFrame | None:
+        """Gets cached candles, or None if they aren't cached or have expired."""
+        with self.lock:
+            df = self.cache.get((str(symbol), resolution, range))
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if df is None else "hit")
+        return df
+
+    def set(self, symbol, resolution: str, range: str, df: pd.DataFrame) -> None:
+        """Caches candles. Empty DataFrames are never cached so failed requests are tried again."""
+        if df.empty:
+            return
+
+        with self.lock:
+            try:
+                self.cache[(str(symbol), resolution, range)] = df
+            except ValueError:
+                log.warning(f"Candles for {symbol} are too large to cache.")
+
+    def get_or_fetch(self, symbol, resolution: str, range: str, fetch: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """Gets cached candles, calling `fetch` to get them if they aren't cached.
+
+        Parameters
+        ----------
+        symbol : Symbol
+        resolution : str
+            Candle size, must be a key of `ttls`.
+        range : str
+            Time range the candles cover, ie: intra or 1M
+        fetch : Callable[[], pd.DataFrame]
+            Downloads the candles.
+
+        Returns
+        -------
+        pd.DataFrame
+            Candles, empty if they couldn't be fetched.
+        """
+        if (df := self.get(symbol, resolution, range)) is not None:
+            return df
+
+        # Candles from the sidecar aren't kept in memory, since they may be close to expiring.
+        shared_key = f"candles:{self.name}:{symbol}:{resolution}:{range}"
+        if (df := shared_cache.get_frame(shared_key)) is not None:
+            return df
+
+        df = fetch()
+        self.set(symbol, resolution, range, df)
+        if not df.empty:
+            shared_cache.set_frame(shared_key, df, self.ttls[resolution])
+        return df
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self) -> dict:
+        """Hit and miss counts along with the memory used."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.cache), "bytes": self.cache.currsize}
@@ -0,0 +1,39 @@
+"""Finds $stock and $$coin cashtags in chat messages.
+"""
+
+import re
+
+# One pass classifies both kinds of tags:
+#   $$ followed by a coin symbol, ie: $$btc $$eth
+#   $ followed by a 1-5 letter ticker with an optional share class, ie: $tsla $BRK.B
+# Tags must start with a letter so prices like $5 or $5.00 are ignored, and must not be
+#   glued to other text, so `$tslaaaaa` and `US$TSLA` aren't treated as tags.
+CASHTAG_REGEX = re.compile(
+    r"(?<![\w$])\$(?:\$(?P<coin>[A-Za-z][A-Za-z0-9]{0,19})|(?P<stock>[A-Za-z]{1,5}(?:\.[A-Za-z]{1,2})?))(?!\w)"
+)
+
+
+def find_cashtags(text: str) -> tuple[list[str], list[str]]:
+    """Finds every stock and coin cashtag in a message.
+
+    Parameters
+    ----------
+    text : str
+        Blob of text.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Unique uppercase stock tickers and lowercase coin symbols without the dollar signs,
+            in the order they first appear.
+    """
+    stocks: dict[str, None] = {}
+    coins: dict[str, None] = {}
+
+    for match in CASHTAG_REGEX.finditer(text):
+        if coin := match.group("coin"):
+            coins[coin.lower()] = None
+        else:
+            stocks[match.group("stock").upper()] = None
+
+    return list(stocks), list(coins)
@@ -1,17 +1,26 @@
 import logging
-from typing import List
+import os
+import threading
+from typing import Dict, List
 
 import pandas as pd
 import requests as r
-import schedule
+from cachetools import TTLCache
 from markdownify import markdownify
-from common.Symbol import Coin
-from common.utilities import rate_limited
 
-import time
+from common.candle_store import CandleStore
+from common.metrics import CACHE_REQUESTS, UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from common.scheduler import scheduler
+from common.sessions import get_session
+from common.shared_cache import shared_cache
+from common.snapshot import Snapshot
+from common.Symbol import Coin, registry
+from common.utilities import SingleFlight, rate_limited, request_key
 
 log = logging.getLogger(__name__)
 
+RATE_LIMIT = 0.5 if os.environ.get("RATE_LIMIT_DIR") else 0.25
+
 
 class cg_Crypto:
     """
@@ -20,26 +29,92 @@ class cg_Crypto:
 
     vs_currency = "usd"  # simple/supported_vs_currencies for list of options
 
+    # Can be pointed at a local stand in, ie: python -m benchmarks.mock_api
+    base_url = os.environ.get("COINGECKO_URL", "https://api.coingecko.com/api/v3").rstrip("/")
+
     trending_cache: List[str] = []
 
+    # Seconds prices and coin details are reused for, CoinGecko only updates them about once a minute anyway.
+    snapshot_ttl = float(os.environ.get("COIN_SNAPSHOT_TTL", 30))
+
     def __init__(self) -> None:
-        self.get_symbol_list()
-        schedule.every().day.do(self.get_symbol_list)
-
-    # Coingecko's rate limit is 30 requests per minute.
-    # Since there are two bots sharing the same IP, we allocate half of that limit to each bot.
-    # This results in a rate limit of 15 requests per minute for each bot.
-    # Given this, the rate limit effectively becomes 1 request every 4 seconds for each bot.
-    @rate_limited(0.25)
+        self.flights = SingleFlight("coingecko")
+
+        # CoinGecko returns 30 minute candles for a day of data and 4 hour candles for a month.
+        self.candles = CandleStore({"30m": 300, "4h": 3600}, name="coingecko_candles")
+
+        # Responses of /simple/price and /coins/{id}, by request.
+        self.snapshots = TTLCache(maxsize=1024, ttl=self.snapshot_ttl)
+        self.snapshot_lock = threading.Lock()
+
+        self.symbol_snapshot = Snapshot("coingecko_coins")
+        self.load_symbol_list()
+        scheduler.every(24 * 3600, self.get_symbol_list, name="coin_symbol_list")
+
+    # Coingecko's rate limit is 30 requests per minute for the IP both bots share.
+    # When RATE_LIMIT_DIR points to a directory shared by both containers they draw from one bucket,
+    #   so a quiet bot leaves its capacity to the busy one. Otherwise each bot gets half of the limit.
     def get(self, endpoint, params: dict = {}, timeout=10) -> dict:
-        url = "https://api.coingecko.com/api/v3" + endpoint
-        resp = r.get(url, params=params, timeout=timeout)
+        """Makes a request to CoinGecko, sharing the response with identical requests that are already in flight.
+            Prices and coin details are cached for `snapshot_ttl` seconds.
+
+        Parameters
+        ----------
+        endpoint : str
+            Path of the endpoint, ie: /simple/price
+        params : dict, optional
+            Query parameters.
+
+        Returns
+        -------
+        dict
+            Parsed JSON response, empty if the request failed.
+        """
+        key = request_key(endpoint, params)
+        if not self.is_snapshot(endpoint):
+            return self.flights.do(key, self._get, endpoint, params, timeout)
+
+        with self.snapshot_lock:
+            cached = self.snapshots.get(key)
+        CACHE_REQUESTS.inc(cache="coin_snapshots", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        # Snapshots from the sidecar aren't kept in memory, since they may be close to expiring.
+        shared_key = f"coin:{endpoint}?{'&'.join(f'{k}={v}' for k, v in key[1])}"
+        if (cached := shared_cache.get_json(shared_key)) is not None:
+            return cached
+
+        if resp := self.flights.do(key, self._get, endpoint, params, timeout):
+            with self.snapshot_lock:
+                self.snapshots[key] = resp
+            shared_cache.set_json(shared_key, resp, self.snapshot_ttl)
+        return resp
+
+    @staticmethod
+    def is_snapshot(endpoint: str) -> bool:
+        """Whether a response is a price or details of coins, which are cached briefly."""
+        parts = endpoint.strip("/").split("/")
+        return parts == ["simple", "price"] or (len(parts) == 2 and parts[0] == "coins" and parts[1] != "list")
+
+    @rate_limited(RATE_LIMIT, burst=5, name="coingecko")
+    def _get(self, endpoint, params: dict = {}, timeout=10) -> dict:
+        url = self.base_url + endpoint
+        label = self.endpoint_label(endpoint)
+        with UPSTREAM_SECONDS.time(provider="coingecko", endpoint=label):
+            try:
+                resp = get_session("coingecko").get(url, params=params, timeout=timeout)
+            except r.exceptions.RequestException:
+                UPSTREAM_RESPONSES.inc(provider="coingecko", endpoint=label, status="error")
+                raise
+        UPSTREAM_RESPONSES.inc(provider="coingecko", endpoint=label, status=resp.status_code)
+
         # Make sure API returned a proper status code
 
         if resp.status_code == 429:
-            log.warning(f"CoinGecko returned 429 - Too Many Requests for endpoint: {endpoint}. Sleeping and trying again.")
-            time.sleep(10)
-            return self.get(endpoint=endpoint, params=params, timeout=timeout)
+            log.warning(f"CoinGecko returned 429 - Too Many Requests for endpoint: {endpoint}. Backing off and trying again.")
+            self._get.bucket.penalize(10)
+            return self._get(endpoint=endpoint, params=params, timeout=timeout)
 
         try:
             resp.raise_for_status()
@@ -55,15 +130,57 @@ class cg_Crypto:
             log.error(e)
             return {}
 
+    @staticmethod
+    def endpoint_label(endpoint: str) -> str:
+        """Endpoint with the coin id removed so metrics aren't split up by coin, ie: /coins/bitcoin/ohlc -> /coins/{id}/ohlc"""
+        parts = endpoint.strip("/").split("/")
+        if parts[0] == "coins" and len(parts) > 1 and parts[1] != "list":
+            parts[1] = "{id}"
+        return "/" + "/".join(parts)
+
     def symbol_id(self, symbol) -> str:
-        try:
-            return self.symbol_list[self.symbol_list["symbol"] == symbol]["id"].values[0]
-        except KeyError:
-            return ""
+        coin = self.lookup(symbol)
+        return coin.id if coin is not None else ""
+
+    def lookup(self, symbol: str) -> Coin | None:
+        """Finds the shared Coin for a symbol, ie: btc. Symbols used by several coins get the first one listed."""
+        return self.coin_list[2].get(symbol.lower())
+
+    @property
+    def symbol_list(self) -> pd.DataFrame:
+        """Every coin with its id, symbol, name, description and type_id."""
+        return self.coin_list[0]
+
+    @property
+    def coins(self) -> Dict[str, Coin]:
+        """Shared Coin of every coin by id, in the order CoinGecko lists them."""
+        return self.coin_list[1]
+
+    def load_symbol_list(self) -> None:
+        """Loads the coin list from the local snapshot so the bot can start right away,
+        then checks for a newer list in the background. Only blocks on the download if there is no snapshot.
+        """
+        if (raw_symbols := self.symbol_snapshot.load()) is not None:
+            self.set_symbol_list(raw_symbols)
+            threading.Thread(target=self.get_symbol_list, name="coingecko-symbols", daemon=True).start()
+        else:
+            self.set_symbol_list([])
+            self.get_symbol_list()
+
+    def fetch_symbol_list(self, headers: dict) -> r.Response:
+        """Requests /coins/list directly since the conditional request needs the raw response."""
+        self._get.bucket.acquire()
+        resp = get_session("coingecko").get(self.base_url + "/coins/list", headers=headers, timeout=30)
+        if resp.status_code == 429:
+            self._get.bucket.penalize(10)
+        return resp
 
     def get_symbol_list(self):
-        raw_symbols = self.get("/coins/list")
-        symbols = pd.DataFrame(data=raw_symbols)
+        if (raw_symbols := self.symbol_snapshot.refresh(self.fetch_symbol_list)) is not None:
+            self.set_symbol_list(raw_symbols)
+
+    def set_symbol_list(self, raw_symbols: list[dict]) -> None:
+        symbols = pd.DataFrame(data=raw_symbols, columns=["id", "symbol", "name"])
 
         # Removes all binance-peg symbols
         symbols = symbols[~symbols["id"].str.contains("binance-peg")]
@@ -72,7 +189,15 @@ class cg_Crypto:
         symbols = symbols[["id", "symbol", "name", "description"]]
         symbols["type_id"] = "$$" + symbols["symbol"]
 
-        self.symbol_list = symbols
+        coins = registry.load(Coin, (Coin(*row) for row in symbols[["id", "symbol", "name"]].itertuples(index=False)))
+
+        # Each lowercase symbol maps to the first coin listed with it.
+        by_symbol: Dict[str, Coin] = {}
+        for coin in coins.values():
+            by_symbol.setdefault(coin.symbol.lower(), coin)
+
+        # Swapped in at once so lookups never use the coins of one list with the rows of another.
+        self.coin_list: tuple[pd.DataFrame, Dict[str, Coin], Dict[str, Coin]] = (symbols, coins, by_symbol)
 
     def status(self) -> str:
         """Checks CoinGecko /ping endpoint for API issues.
@@ -82,8 +207,8 @@ class cg_Crypto:
         str
             Human readable text on status of CoinGecko API
         """
-        status = r.get(
-            "https://api.coingecko.com/api/v3/ping",
+        status = get_session("coingecko").get(
+            self.base_url + "/ping",
             timeout=5,
         )
 
@@ -144,7 +269,7 @@ class cg_Crypto:
         return message
 
     def intra_reply(self, symbol: Coin) -> pd.DataFrame:
-        """Returns price data for a symbol since the last market open.
+        """Returns price data for a symbol over the past day. Cached for 5 minutes.
 
         Parameters
         ----------
@@ -157,9 +282,13 @@ class cg_Crypto:
             Returns a timeseries dataframe with high, low, and volume data if its available. Otherwise returns empty pd.DataFrame.
         """
 
+        return self.candles.get_or_fetch(symbol, "30m", "1d", lambda: self.fetch_ohlc(symbol, days=1))
+
+    def fetch_ohlc(self, symbol: Coin, days: int) -> pd.DataFrame:
+        """Downloads candles for the past number of days. CoinGecko picks the candle size based on the number of days."""
         if resp := self.get(
             f"/coins/{symbol.id}/ohlc",
-            params={"vs_currency": self.vs_currency, "days": 1},
+            params={"vs_currency": self.vs_currency, "days": days},
         ):
             df = pd.DataFrame(resp, columns=["Date", "Open", "High", "Low", "Close"]).dropna()
             df["Date"] = pd.to_datetime(df["Date"], unit="ms")
@@ -170,7 +299,7 @@ class cg_Crypto:
 
     def chart_reply(self, symbol: Coin) -> pd.DataFrame:
         """Returns price data for a symbol of the past month up until the previous trading days close.
-        Also caches multiple requests made in the same day.
+        Cached for an hour so that repeated requests don't download the candles again.
 
         Parameters
         ----------
@@ -183,16 +312,7 @@ class cg_Crypto:
             Returns a timeseries dataframe with high, low, and volume data if its available. Otherwise returns empty pd.DataFrame.
         """
 
-        if resp := self.get(
-            f"/coins/{symbol.id}/ohlc",
-            params={"vs_currency": self.vs_currency, "days": 30},
-        ):
-            df = pd.DataFrame(resp, columns=["Date", "Open", "High", "Low", "Close"]).dropna()
-            df["Date"] = pd.to_datetime(df["Date"], unit="ms")
-            df = df.set_index("Date")
-            return df
-
-        return pd.DataFrame()
+        return self.candles.get_or_fetch(symbol, "4h", "1M", lambda: self.fetch_ohlc(symbol, days=30))
 
     def stat_reply(self, symbol: Coin) -> str:
         """Gathers key statistics on coin. Mostly just CoinGecko scores.
@@ -308,6 +428,9 @@ class cg_Crypto:
     def trending(self) -> list[str]:
         """Gets current coins trending on coingecko
 
+        The 24 hour change comes from the trending payload, any coins it is missing for
+            are priced together in a single /simple/price call.
+
         Returns
         -------
         list[str]
@@ -316,24 +439,29 @@ class cg_Crypto:
 
         coins = self.get("/search/trending")
         try:
-            trending = []
-            for coin in coins["coins"]:
-                c = coin["item"]
-
-                sym = c["symbol"].upper()
-                name = c["name"]
-                change = self.get(
+            items = [coin["item"] for coin in coins["coins"]]
+
+            missing = [
+                c["id"] for c in items if c.get("data", {}).get("price_change_percentage_24h", {}).get(self.vs_currency) is None
+            ]
+            prices = {}
+            if missing:
+                prices = self.get(
                     "/simple/price",
                     params={
-                        "ids": c["id"],
+                        "ids": ",".join(missing),
                         "vs_currencies": self.vs_currency,
                         "include_24hr_change": "true",
                     },
-                )[c["id"]]["usd_24h_change"]
+                )
 
-                msg = f"`$${sym}`: {name}, {change:.2f}%"
+            trending = []
+            for c in items:
+                change = c.get("data", {}).get("price_change_percentage_24h", {}).get(self.vs_currency)
+                if change is None:
+                    change = prices.get(c["id"], {}).get(f"{self.vs_currency}_24h_change") or 0.0
 
-                trending.append(msg)
+                trending.append(f"`$${c['symbol'].upper()}`: {c['name']}, {change:.2f}%")
 
         except Exception as e:
             log.warning(e)
@@ -352,7 +480,8 @@ class cg_Crypto:
         Returns
         -------
         list[str]
-            returns preformatted list of strings detailing price movement of each coin passed in.
+            returns preformatted list of strings detailing price movement of each coin passed in,
+                one for each coin in the same order they were passed in.
         """
         query = ",".join([c.id for c in coins])
 
@@ -368,13 +497,12 @@ class cg_Crypto:
         replies = []
         for coin in coins:
             if coin.id in prices:
+                # Responses are shared through the snapshot cache, so they're read without being changed.
                 p = prices[coin.id]
+                change = p.get("usd_24h_change") or 0
 
-                if p.get("usd_24h_change") is None:
-                    p["usd_24h_change"] = 0
-
-                replies.append(
-                    f"{coin.name}: ${p.get('usd',0):,} and has moved {p.get('usd_24h_change',0.0):.2f}% in the past 24 hours."
-                )
+                replies.append(f"{coin.name}: ${p.get('usd',0):,} and has moved {change:.2f}% in the past 24 hours.")
+            else:
+                replies.append(f"The price for {coin.name} is not available. If you suspect this is an error run `/status`")
 
         return replies
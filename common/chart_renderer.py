@@ -0,0 +1,260 @@
+"""Renders charts in a pool of worker processes so drawing never blocks the bots event loop.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from cachetools import LRUCache
+
+from common import metrics
+from common.metrics import CACHE_REQUESTS
+from common.shared_cache import shared_cache
+
+log = logging.getLogger(__name__)
+
+RENDER_SECONDS = metrics.histogram("chart_render_seconds", "Time spent drawing charts.", ["type"])
+RENDER_WAIT_SECONDS = metrics.histogram(
+    "chart_wait_seconds", "Time from asking for a chart to it being drawn, including the queue.", ["type"]
+)
+PENDING_CHARTS = metrics.gauge("chart_queue", "Charts waiting to be drawn.")
+
+
+class ChartQueueFull(Exception):
+    """Raised when too many charts are already waiting to be rendered."""
+
+
+def _init_worker() -> None:
+    # Importing matplotlib and mplfinance takes longer than most renders, so workers do it once when they start.
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import mplfinance  # noqa: F401
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _render(df: pd.DataFrame, spec: dict) -> tuple[bytes, float]:
+    import mplfinance as mpf
+
+    start = time.perf_counter()
+
+    buf = io.BytesIO()
+    mpf.plot(
+        df,
+        type=spec["type"],
+        title=spec["title"],
+        volume=spec["volume"],
+        style=spec["style"],
+        savefig=dict(fname=buf, dpi=spec["dpi"], bbox_inches="tight"),
+    )
+
+    return buf.getvalue(), time.perf_counter() - start
+
+
+class ChartRenderer:
+    """
+    Pool of processes that keep mplfinance imported and turn DataFrames into PNGs.
+
+    Workers are started by a forkserver rather than forked from the bot, which runs scheduler and router threads.
+        They run the bots main script again as __mp_main__, so the bots only start outside of it.
+    """
+
+    def __init__(self, workers: int | None = None, max_queue: int | None = None, timeout: float = 30) -> None:
+        self.workers = workers or int(os.environ.get("CHART_WORKERS", 2))
+        self.max_queue = max_queue or int(os.environ.get("CHART_QUEUE", 16))
+        self.timeout = timeout
+
+        self.executor: ProcessPoolExecutor | None = None
+        self.restart_lock = asyncio.Lock()
+        # Charts submitted to the workers that haven't finished, including ones whose render timed out.
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+
+        # Rendered PNGs, bounded by their total size in bytes.
+        self.cache = LRUCache(maxsize=int(os.environ.get("CHART_CACHE_BYTES", 64 * 1024 * 1024)), getsizeof=len)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Seconds charts are kept in the cache sidecar.
+        self.shared_ttl = 3600
+
+        # Telegram file_id of charts that have already been uploaded, so they can be sent again without uploading.
+        self.file_ids = LRUCache(maxsize=4096)
+
+        # Per-render timing, render_seconds is time spent drawing and wait_seconds includes time in the queue.
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.wait_seconds = 0.0
+
+        PENDING_CHARTS.track(lambda: self.pending)
+
+    def start(self) -> None:
+        """Starts the worker processes, blocking until they are ready."""
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["common.chart_renderer"])
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker)
+
+        # Workers start as tasks are submitted, so warm all of them up before the first chart is waiting on one.
+        for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        self.executor = executor
+        log.info(f"Started {self.workers} chart rendering workers.")
+
+    async def restart(self) -> ProcessPoolExecutor:
+        """Starts a new pool off the event loop, once for every render that was waiting on it."""
+        async with self.restart_lock:
+            if self.executor is None:
+                await asyncio.to_thread(self.start)
+        return self.executor
+
+    def discard(self, executor: ProcessPoolExecutor) -> None:
+        """Shuts down a broken pool so its management thread and dead workers don't leak."""
+        if self.executor is executor:
+            self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def rendered(self, future) -> None:
+        # Called from the pools management thread once a worker is done with a chart, even one that timed out.
+        with self.pending_lock:
+            self.pending -= 1
+
+    @staticmethod
+    def chart_key(symbol, type: str, range: str, df: pd.DataFrame) -> tuple:
+        """Key that identifies a rendered chart. Charts of the same symbol, type and range are only
+            drawn again when the candles they are drawn from change.
+
+        Parameters
+        ----------
+        symbol : Symbol
+        type : str
+            mplfinance chart type.
+        range : str
+            Time range the chart covers, ie: intra or 1M
+        df : pd.DataFrame
+            Candles the chart is drawn from.
+
+        Returns
+        -------
+        tuple
+            Hashable key for `render` and `file_ids`.
+        """
+        fingerprint = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+        return (str(symbol), type, range, fingerprint)
+
+    async def render(
+        self,
+        df: pd.DataFrame,
+        type: str = "candle",
+        title: str = "",
+        volume: bool = False,
+        style: str = "yahoo",
+        dpi: int = 400,
+        key: tuple | None = None,
+    ) -> bytes:
+        """Renders a chart, or returns it from the cache if it has already been drawn.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Timeseries with Open, High, Low, Close and optionally Volume columns.
+        type : str, optional
+            mplfinance chart type, by default "candle"
+        title : str, optional
+            Chart title.
+        volume : bool, optional
+            Whether to draw volume bars, by default False
+        key : tuple, optional
+            Cache key from `chart_key`, charts without a key are never cached.
+
+        Returns
+        -------
+        bytes
+            PNG image.
+
+        Raises
+        ------
+        ChartQueueFull
+            If there are already `max_queue` charts waiting to render.
+        TimeoutError
+            If the chart isn't drawn within `timeout` seconds.
+        """
+        spec = {"type": type, "title": title, "volume": volume, "style": style, "dpi": dpi}
+
+        if key is not None:
+            try:
+                png = self.cache[key]
+                self.cache_hits += 1
+                CACHE_REQUESTS.inc(cache="charts", result="hit")
+                return png
+            except KeyError:
+                self.cache_misses += 1
+                CACHE_REQUESTS.inc(cache="charts", result="miss")
+
+            # Charts are keyed by the candles they are drawn from so ones drawn by the other bot never go stale.
+            if shared_cache.enabled and (png := await asyncio.to_thread(shared_cache.get, self.shared_key(key, spec))):
+                self.cache[key] = png
+                return png
+
+        if self.pending >= self.max_queue:
+            raise ChartQueueFull(f"{self.pending} charts are already waiting to render.")
+
+        executor = self.executor or await self.restart()
+
+        start = time.perf_counter()
+        try:
+            future = executor.submit(_render, df, spec)
+            with self.pending_lock:
+                self.pending += 1
+            future.add_done_callback(self.rendered)
+
+            # Timing out cancels charts that are still queued, ones already being drawn stay pending until they finish.
+            png, render_seconds = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except BrokenProcessPool:
+            log.error("Chart worker died, restarting the pool.")
+            self.discard(executor)
+            raise
+        except TimeoutError:
+            log.warning(f"{type} chart wasn't drawn within {self.timeout} seconds.")
+            raise
+
+        wait_seconds = time.perf_counter() - start
+        self.renders += 1
+        self.render_seconds += render_seconds
+        self.wait_seconds += wait_seconds
+        RENDER_SECONDS.observe(render_seconds, type=type)
+        RENDER_WAIT_SECONDS.observe(wait_seconds, type=type)
+        log.info(f"Rendered {type} chart in {render_seconds:.2f} seconds, {wait_seconds:.2f} seconds including the queue.")
+
+        if key is not None:
+            self.cache[key] = png
+            if shared_cache.enabled:
+                await asyncio.to_thread(shared_cache.set, self.shared_key(key, spec), png, self.shared_ttl)
+
+        return png
+
+    @staticmethod
+    def shared_key(key: tuple, spec: dict) -> str:
+        """Key in the cache sidecar, which includes how the chart is drawn since each bot draws them differently."""
+        return "chart:" + ":".join(map(str, key + tuple(spec.values())))
+
+    def stats(self) -> dict:
+        """Queue depth, average render timing and cache usage."""
+        return {
+            "pending": self.pending,
+            "renders": self.renders,
+            "avg_render_seconds": self.render_seconds / self.renders if self.renders else 0.0,
+            "avg_wait_seconds": self.wait_seconds / self.renders if self.renders else 0.0,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_bytes": self.cache.currsize,
+        }
@@ -0,0 +1,282 @@
+"""Counters, gauges and histograms served in the Prometheus text format.
+
+Metrics are created at import time by the modules that record them, ie:
+    UPSTREAM_SECONDS = metrics.histogram("upstream_request_seconds", "Upstream API latency.", ["provider", "endpoint"])
+    UPSTREAM_SECONDS.observe(0.25, provider="coingecko", endpoint="/simple/price")
+
+and served over HTTP once `serve` is called, when the METRICS_PORT environment variable is set.
+"""
+
+import bisect
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator
+
+log = logging.getLogger(__name__)
+
+PREFIX = "stockbot_"
+
+# Seconds, covers cache hits through upstream timeouts.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Base for metrics, values are stored per combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: list[str] | tuple = ()) -> None:
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self.lock = threading.Lock()
+        self.values: dict[tuple, float] = {}
+        # Values read when the metrics are collected instead of being recorded as they happen.
+        self.callbacks: dict[tuple, Callable[[], float | None]] = {}
+
+    def key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def track(self, func: Callable[[], float | None], **labels) -> None:
+        """Reads the value from `func` whenever metrics are collected. Returning None skips the sample."""
+        self.callbacks[self.key(labels)] = func
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        with self.lock:
+            values = dict(self.values)
+
+        for key, func in self.callbacks.items():
+            try:
+                value = func()
+            except Exception as e:
+                log.warning(f"Failed to collect {self.name}: {e}")
+                continue
+            if value is not None:
+                values[key] = value
+
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value that only goes up, ie: requests made."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: list[str] | tuple = ()) -> None:
+        super().__init__(name if name.endswith("_total") else name + "_total", help, labelnames)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down, ie: charts waiting to render."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values, ie: request latency, counted into cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: list[str] | tuple = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key: [count in each bucket, then +Inf], sum
+        self.observations: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.observations.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the block inside the `with` takes, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        with self.lock:
+            observations = {key: (list(counts), total[0]) for key, (counts, total) in self.observations.items()}
+
+        for key, (counts, total) in observations.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """Every metric in the process, looked up by name so modules can share them."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+        self.server: ThreadingHTTPServer | None = None
+
+    def register(self, cls: type, name: str, *args, **kwargs) -> Metric:
+        with self.lock:
+            if (metric := self.metrics.get(name)) is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"{name} is already registered as a {metric.type}.")
+            return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def serve(self, port: int | None = None, host: str | None = None) -> ThreadingHTTPServer | None:
+        """Serves /metrics on a background thread.
+
+        Parameters
+        ----------
+        port : int, optional
+            Defaults to the METRICS_PORT environment variable, metrics aren't served if neither is set.
+        host : str, optional
+            Defaults to the METRICS_HOST environment variable or 127.0.0.1
+
+        Returns
+        -------
+        ThreadingHTTPServer | None
+            The running server, or None if metrics aren't being served.
+        """
+        if self.server is not None:
+            return self.server
+
+        port = port if port is not None else int(os.environ.get("METRICS_PORT", 0)) or None
+        if port is None:
+            return None
+        host = host or os.environ.get("METRICS_HOST", "127.0.0.1")
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return self.server
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: list[str] | tuple = ()) -> Counter:
+    return REGISTRY.register(Counter, name, help, labelnames)
+
+
+def gauge(name: str, help: str, labelnames: list[str] | tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge, name, help, labelnames)
+
+
+def histogram(
+    name: str, help: str, labelnames: list[str] | tuple = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram, name, help, labelnames, buckets)
+
+
+def serve(port: int | None = None, host: str | None = None) -> ThreadingHTTPServer | None:
+    return REGISTRY.serve(port, host)
+
+
+def timed(metric: Histogram, **labels):
+    """Decorator that observes how long each call to an async function takes."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        async def timed_function(*args, **kwargs):
+            with metric.time(**labels):
+                return await func(*args, **kwargs)
+
+        return timed_function
+
+    return decorate
+
+
+# Shared by both data providers.
+UPSTREAM_SECONDS = histogram("upstream_request_seconds", "Latency of upstream API requests.", ["provider", "endpoint"])
+UPSTREAM_RESPONSES = counter(
+    "upstream_responses",
+    "Upstream API responses by status code, or error if none was received.",
+    ["provider", "endpoint", "status"],
+)
+CACHE_REQUESTS = counter("cache_requests", "Cache lookups by whether they hit.", ["cache", "result"])
+HANDLER_SECONDS = histogram("handler_seconds", "Time taken to handle each bot command.", ["bot", "command"])
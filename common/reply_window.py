@@ -0,0 +1,124 @@
+"""Keeps busy chats from getting the same price reply over and over when a symbol is mentioned by several people.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from cachetools import LRUCache
+
+from common import metrics
+from common.snapshot import Snapshot
+from common.Symbol import Symbol
+
+log = logging.getLogger(__name__)
+
+COALESCED = metrics.counter(
+    "coalesced_symbols", "Mentions that weren't answered since the symbol was just answered in the same chat.", ["bot"]
+)
+
+# Longest window a chat can set, in seconds.
+MAX_WINDOW = 3600
+
+
+class ReplyWindow:
+    """
+    Remembers which symbols were recently answered in each chat, so a symbol is answered at most once per window.
+
+    Symbols are claimed before their prices are fetched, so mentions that arrive while the first reply is still
+        being fetched are collapsed into it as well. Chats can change their window, which is saved to a snapshot.
+    """
+
+    def __init__(self, bot: str, default: float | None = None, max_chats: int = 10_000) -> None:
+        """
+        Parameters
+        ----------
+        bot : str
+            Name of the bot, used for its snapshot and metrics.
+        default : float, optional
+            Window in seconds for chats that haven't set one, defaults to the REPLY_WINDOW environment variable or 10.
+                0 answers every mention.
+        max_chats : int, optional
+            Chats whose recent replies are remembered, the least recently active are forgotten first.
+        """
+        self.bot = bot
+        self.default = default if default is not None else float(os.environ.get("REPLY_WINDOW", 10))
+
+        # chat id: {symbol tag: time it was answered}
+        self.answered: LRUCache = LRUCache(maxsize=max_chats)
+        self.lock = threading.Lock()
+
+        self.snapshot = Snapshot(f"{bot}_reply_windows")
+        self.windows: dict[str, float] = self.snapshot.load() or {}
+
+    def window(self, chat_id) -> float:
+        """Seconds a symbol isn't answered again for in a chat."""
+        return self.windows.get(str(chat_id), self.default)
+
+    def set_window(self, chat_id, seconds: float) -> None:
+        """Changes the window of a chat, going back to the default when it's set to the default.
+
+        Raises
+        ------
+        ValueError
+            If the window is negative or longer than `MAX_WINDOW`.
+        """
+        if not 0 <= seconds <= MAX_WINDOW:
+            raise ValueError(f"The window must be between 0 and {MAX_WINDOW} seconds.")
+
+        with self.lock:
+            if seconds == self.default:
+                self.windows.pop(str(chat_id), None)
+            else:
+                self.windows[str(chat_id)] = seconds
+            windows = dict(self.windows)
+        self.snapshot.save(windows)
+
+    def claim(self, chat_id, symbols: list[Symbol], now: float | None = None) -> list[Symbol]:
+        """Symbols that haven't been answered in the chat within its window, which are then marked as answered.
+
+        Parameters
+        ----------
+        chat_id
+            Telegram chat or Discord channel id.
+        symbols : list[Symbol]
+            Symbols mentioned in a message.
+
+        Returns
+        -------
+        list[Symbol]
+            Symbols to answer, in the same order and without duplicates.
+        """
+        # Symbols repeated in one message are answered once, and aren't counted as coalesced.
+        symbols = list(dict.fromkeys(symbols))
+
+        window = self.window(chat_id)
+        if not window:
+            return symbols
+
+        now = time.monotonic() if now is None else now
+        claimed = []
+        with self.lock:
+            answered = self.answered.get(chat_id)
+            if answered is None:
+                answered = self.answered[chat_id] = {}
+
+            for tag in [tag for tag, at in answered.items() if now - at >= window]:
+                del answered[tag]
+
+            for symbol in symbols:
+                if symbol.tag not in answered:
+                    answered[symbol.tag] = now
+                    claimed.append(symbol)
+
+        if coalesced := len(symbols) - len(claimed):
+            COALESCED.inc(coalesced, bot=self.bot)
+        return claimed
+
+    def release(self, chat_id, symbols: list[Symbol]) -> None:
+        """Forgets that symbols were answered, ie: when replying to them failed, so the next mention is answered."""
+        with self.lock:
+            if (answered := self.answered.get(chat_id)) is not None:
+                for symbol in symbols:
+                    answered.pop(symbol.tag, None)
@@ -0,0 +1,140 @@
+"""Runs maintenance jobs in the background on the bots event loop, so they never hold up a reply.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable
+
+from common import metrics
+
+log = logging.getLogger(__name__)
+
+JOB_SECONDS = metrics.histogram(
+    "job_seconds", "Time taken by each scheduled job.", ["job"], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+JOB_FAILURES = metrics.counter("job_failures", "Scheduled job runs that raised an exception.", ["job"])
+
+
+class Job:
+    """A function that is run every `interval` seconds, along with how its runs have gone."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], object], immediately: bool = False) -> None:
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.immediately = immediately
+
+        self.runs = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.last_seconds: float | None = None
+        self.last_run: float | None = None
+        self.last_error: str | None = None
+        self.task: asyncio.Task | None = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "avg_seconds": self.total_seconds / self.runs if self.runs else 0.0,
+            "last_seconds": self.last_seconds,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    """
+    Jobs are registered with `every` whenever, then run as asyncio tasks once `start` is called from the bots event loop.
+
+    Each job runs on a worker thread since they are mostly blocking downloads, and a job never overlaps with itself.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: dict[str, Job] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def every(self, seconds: float, func: Callable[[], object], name: str | None = None, immediately: bool = False) -> Job:
+        """Registers a job.
+
+        Parameters
+        ----------
+        seconds : float
+            Seconds between the end of one run and the start of the next.
+        func : Callable[[], object]
+            Blocking function that does the work.
+        name : str, optional
+            Name the job is logged and reported under, defaults to the functions qualified name.
+        immediately : bool, optional
+            Run the job as soon as the scheduler starts instead of waiting a full interval, by default False
+
+        Returns
+        -------
+        Job
+        """
+        job = Job(name or func.__qualname__, seconds, func, immediately)
+        self.jobs[job.name] = job
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.launch, job)
+
+        return job
+
+    def start(self) -> None:
+        """Starts every job on the running event loop. Calling it again, ie: when Discord reconnects, does nothing."""
+        if self.loop is not None:
+            return
+
+        self.loop = asyncio.get_running_loop()
+        for job in self.jobs.values():
+            self.launch(job)
+        log.info(f"Started {len(self.jobs)} scheduled jobs.")
+
+    def launch(self, job: Job) -> None:
+        if job.task is None or job.task.done():
+            job.task = self.loop.create_task(self.run_forever(job), name=f"job:{job.name}")
+
+    async def run_forever(self, job: Job) -> None:
+        if not job.immediately:
+            await asyncio.sleep(job.interval)
+
+        while True:
+            await self.run(job)
+            await asyncio.sleep(job.interval)
+
+    async def run(self, job: Job) -> None:
+        """Runs a job once, recording how long it took and whether it failed."""
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(job.func)
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = repr(e)
+            JOB_FAILURES.inc(job=job.name)
+            log.exception(f"Scheduled job {job.name} failed.")
+
+        job.last_seconds = time.perf_counter() - start
+        job.last_run = time.time()
+        job.runs += 1
+        job.total_seconds += job.last_seconds
+        JOB_SECONDS.observe(job.last_seconds, job=job.name)
+        log.info(f"Ran scheduled job {job.name} in {job.last_seconds:.2f} seconds.")
+
+    async def stop(self) -> None:
+        """Cancels every job, waiting for them to finish."""
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop = None
+
+    def stats(self) -> dict:
+        """Durations and failures of each job."""
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+# Shared by everything in the process, jobs can be registered before the event loop exists.
+scheduler = Scheduler()
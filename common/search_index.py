@@ -0,0 +1,149 @@
+"""Prefix search index over every stock and crypto symbol the bot knows about.
+"""
+
+import bisect
+import heapq
+import logging
+import re
+from typing import Dict, List, Tuple
+
+from common.Symbol import Coin, Stock, Symbol
+
+log = logging.getLogger(__name__)
+
+
+class SearchIndex:
+    """
+    Sorted array of search tokens (symbols and words in names) that is searched with bisect.
+
+    Every result is ranked by how it matched, exact symbol matches first, then symbols that start with the search,
+        then names with a word that starts with the search. Ties go to the shortest symbol, then market cap rank.
+    """
+
+    # Words that show up in so many names they would only slow down searches.
+    #   They are kept apart and only searched when the search is nothing but these words.
+    STOP_WORDS = {
+        "&", "ag", "and", "co", "coin", "company", "corp", "corporation", "group", "holdings",
+        "inc", "llc", "lp", "ltd", "nv", "of", "plc", "sa", "the", "token",
+    }  # fmt: skip
+
+    # Short searches match too many tokens to rank quickly, so their results are computed when the index is built.
+    PRECOMPUTED_LENGTH = 2
+
+    WORD_REGEX = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, entries: List[Tuple[str, str, str, str, int, Symbol]], max_matches: int = 10) -> None:
+        """Builds the index.
+
+        Parameters
+        ----------
+        entries : List[Tuple[str, str, str, str, int, Symbol]]
+            (symbol, name, type_id, description, rank, Symbol) for every searchable symbol.
+        max_matches : int, optional
+            Most results that will ever be requested from `search`, by default 10
+        """
+        self.max_matches = max_matches
+        self.sources: tuple = ()  # Symbol lists the index was built from
+        self.type_ids = [e[2] for e in entries]
+        self.descriptions = [e[3] for e in entries]
+        self.symbols = [e[5] for e in entries]
+
+        tokens, stop_tokens = [], []
+        for i, (symbol, name, type_id, _, rank, _) in enumerate(entries):
+            base = (len(type_id), rank, i)
+            symbol = symbol.lower()
+            tokens.append((symbol, (1, *base)))
+
+            words = set(self.WORD_REGEX.findall(name.lower())) - {symbol}
+            tokens.extend((word, (2, *base)) for word in words - self.STOP_WORDS)
+            stop_tokens.extend((word, (2, *base)) for word in words & self.STOP_WORDS)
+
+        tokens.sort()
+        self.keys = [t[0] for t in tokens]
+        self.scores = [t[1] for t in tokens]
+
+        stop_tokens.sort()
+        self.stop_keys = [t[0] for t in stop_tokens]
+        self.stop_scores = [t[1] for t in stop_tokens]
+
+        self.precomputed: Dict[str, List[int]] = {}
+        short = {k[:n] for k in self.keys for n in range(1, self.PRECOMPUTED_LENGTH + 1)}
+        for prefix in short:
+            self.precomputed[prefix] = self._rank(prefix, max_matches)
+
+    @classmethod
+    def from_symbol_lists(cls, stocks: Dict[str, Stock], coins: Dict[str, Coin], max_matches: int = 10) -> "SearchIndex":
+        """Builds an index from `MarketData.symbol_list` and `cg_Crypto.coins`."""
+        entries = []
+        for ticker, stock in stocks.items():
+            entries.append((ticker, stock.name, stock.tag, f"${ticker}: {stock.name}", stock.market_cap_rank, stock))
+
+        # CoinGecko doesn't rank coins in the list, so they rank below every stock.
+        coin_rank = len(entries)
+        for coin in coins.values():
+            entries.append((coin.symbol, coin.name, "$$" + coin.symbol, f"{coin.tag}: {coin.name}", coin_rank, coin))
+
+        index = cls(entries, max_matches)
+        index.sources = (stocks, coins)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.type_ids)
+
+    def _rank(self, query: str, matches: int, rest: List[str] = [], stop_words: bool = False) -> List[int]:
+        """Best `matches` entries with a token that starts with `query` and `rest` in their description.
+        Entries that share a type_id, like coins with the same symbol, only give their best match.
+        """
+        indexes = [(self.keys, self.scores)]
+        if stop_words:
+            indexes.append((self.stop_keys, self.stop_scores))
+
+        # type_id: best score
+        best: Dict[str, tuple] = {}
+        for keys, scores in indexes:
+            lo = bisect.bisect_left(keys, query)
+            hi = bisect.bisect_left(keys, query + "\uffff", lo)
+
+            for key, score in zip(keys[lo:hi], scores[lo:hi]):
+                if key == query and score[0] == 1:
+                    score = (0, *score[1:])
+                entry = score[-1]
+                type_id = self.type_ids[entry]
+                if type_id in best and best[type_id] <= score:
+                    continue
+                if rest and not all(w in self.descriptions[entry].lower() for w in rest):
+                    continue
+                best[type_id] = score
+
+        return [score[-1] for score in heapq.nsmallest(matches, best.values())]
+
+    def search(self, query: str, matches: int = 5) -> List[Tuple[str, str, Symbol]]:
+        """Finds the best matching symbols for a search.
+
+        Parameters
+        ----------
+        query : str
+            Search text, can be a symbol with or without $ or words from the name.
+        matches : int, optional
+            Max number of results, by default 5
+
+        Returns
+        -------
+        List[Tuple[str, str, Symbol]]
+            (type_id, description, Symbol) of each result, best match first.
+        """
+        words = self.WORD_REGEX.findall(query.lower())
+        if not words:
+            return []
+
+        # Rank on the longest word since it narrows the search the most, then make sure every other word is present.
+        first = max(words, key=len)
+        rest = [w for w in words if w != first]
+        stop_words = all(w in self.STOP_WORDS for w in words)
+
+        if len(first) <= self.PRECOMPUTED_LENGTH and not rest and not stop_words:
+            ranked = self.precomputed.get(first, [])
+        else:
+            ranked = self._rank(first, matches, rest, stop_words)
+
+        return [(self.type_ids[i], self.descriptions[i], self.symbols[i]) for i in ranked[:matches]]
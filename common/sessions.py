@@ -0,0 +1,94 @@
+"""Shared HTTP sessions so that every provider reuses keep-alive connections.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict
+
+import requests as r
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = "Simple Stock Bot anson@ansonbiggs.com"
+
+# Connection pool sizes can be tuned per provider with environment variables, ie:
+# HTTP_POOL_MARKETDATA=20 or HTTP_POOL_SIZE=10 to change the default for every provider.
+DEFAULT_POOL_SIZE = 10
+
+_sessions: Dict[str, r.Session] = {}
+_lock = threading.Lock()
+
+
+def pool_size(provider: str) -> int:
+    """Gets the configured connection pool size for a provider.
+
+    Parameters
+    ----------
+    provider : str
+        Name of the provider, ie: marketdata or coingecko
+
+    Returns
+    -------
+    int
+        Max number of keep-alive connections kept open to that provider.
+    """
+    size = os.environ.get(f"HTTP_POOL_{provider.upper()}", os.environ.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+    try:
+        return max(1, int(size))
+    except ValueError:
+        log.warning(f"Invalid pool size {size} for {provider}, using {DEFAULT_POOL_SIZE}.")
+        return DEFAULT_POOL_SIZE
+
+
+def get_session(provider: str) -> r.Session:
+    """Returns the shared session for a provider, creating it on first use.
+
+    Each provider gets its own connection pool so that a burst of requests to one API
+        can't starve connections to another.
+
+    Parameters
+    ----------
+    provider : str
+        Name of the provider, ie: marketdata or coingecko
+
+    Returns
+    -------
+    r.Session
+        Session with keep-alive connection pooling and gzip enabled.
+    """
+    try:
+        return _sessions[provider]
+    except KeyError:
+        pass
+
+    with _lock:
+        if provider not in _sessions:
+            size = pool_size(provider)
+
+            session = r.Session()
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(
+                {
+                    "User-Agent": USER_AGENT,
+                    "Accept-Encoding": "gzip, deflate",
+                    "Connection": "keep-alive",
+                }
+            )
+
+            log.info(f"Created HTTP session for {provider} with a pool size of {size}.")
+            _sessions[provider] = session
+
+        return _sessions[provider]
+
+
+def close_sessions() -> None:
+    """Closes every open session and its pooled connections."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
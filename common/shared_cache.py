@@ -0,0 +1,229 @@
+"""Client for the cache sidecar that lets the Telegram and Discord bots share quotes, candles, coin data and charts.
+
+The sidecar is `python -m common.cache_server`, and is used when the SHARED_CACHE environment variable points at it:
+    SHARED_CACHE=unix:/var/lib/simple-stock-bot/cache.sock
+    SHARED_CACHE=cache:7380
+
+It sits behind each bots own in memory caches, which keep working on their own while the sidecar is unreachable.
+
+Each request and response is a frame of two big endian uint32 lengths, then that many bytes of JSON header and
+    of body, ie: {"op": "set", "key": "quote:TSLA", "ttl": 5} followed by the value.
+"""
+
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from common.metrics import CACHE_REQUESTS
+
+log = logging.getLogger(__name__)
+
+FRAME = struct.Struct("!II")
+
+# Values larger than this are never sent, rendered charts are well under it.
+MAX_VALUE_BYTES = 16 * 1024 * 1024
+
+
+def pack(header: dict, body: bytes = b"") -> bytes:
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    return FRAME.pack(len(encoded), len(body)) + encoded + body
+
+
+def parse_address(address: str) -> tuple[int, str | tuple[str, int]]:
+    """Socket family and address of `unix:/path/to.sock` or `host:port`."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address.removeprefix("unix:").removeprefix("//")
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid cache address {address}, expected unix:/path/to.sock or host:port")
+    return socket.AF_INET, (host, int(port))
+
+
+def encode_frame(df: pd.DataFrame) -> bytes:
+    """Candles as JSON, keeping the index timezone so charts and captions come out the same after decoding."""
+    index = df.index
+    dates = isinstance(index, pd.DatetimeIndex)
+    payload = {
+        "index": index.asi8.tolist() if dates else index.tolist(),
+        "unit": index.unit if dates else None,
+        "tz": str(index.tz) if dates and index.tz is not None else None,
+        "name": index.name,
+        "columns": {column: df[column].tolist() for column in df.columns},
+        "dtypes": {column: str(dtype) for column, dtype in df.dtypes.items()},
+    }
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def decode_frame(data: bytes) -> pd.DataFrame:
+    payload = json.loads(data)
+    if payload["unit"]:
+        index = pd.DatetimeIndex(np.array(payload["index"], dtype=f"datetime64[{payload['unit']}]"))
+        if payload["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(payload["tz"])
+    else:
+        index = pd.Index(payload["index"])
+    index.name = payload["name"]
+
+    columns = {column: pd.array(values, dtype=payload["dtypes"][column]) for column, values in payload["columns"].items()}
+    return pd.DataFrame(columns, index=index)
+
+
+class SharedCache:
+    """
+    Blocking client for the cache sidecar, safe to use from any thread.
+
+    Every failure is treated as a miss. After one, the sidecar is left alone for `retry_after` seconds
+        so a missing sidecar costs nothing but a log line.
+    """
+
+    def __init__(self, address: str | None = None, timeout: float | None = None, retry_after: float = 30) -> None:
+        """
+        Parameters
+        ----------
+        address : str, optional
+            unix:/path/to.sock or host:port, defaults to the SHARED_CACHE environment variable.
+                The cache is disabled if neither is set.
+        timeout : float, optional
+            Seconds to wait on the sidecar, defaults to the SHARED_CACHE_TIMEOUT environment variable or 0.25
+        retry_after : float, optional
+            Seconds to wait after a failure before using the sidecar again, by default 30
+        """
+        self.address = address if address is not None else os.environ.get("SHARED_CACHE") or None
+        self.timeout = timeout or float(os.environ.get("SHARED_CACHE_TIMEOUT", 0.25))
+        self.retry_after = retry_after
+
+        self.family, self.sockaddr = parse_address(self.address) if self.address else (None, None)
+        self.local = threading.local()
+        self.down_until = 0.0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.address is not None
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and time.monotonic() >= self.down_until
+
+    def connection(self) -> socket.socket:
+        """This threads connection to the sidecar, connecting if there isn't one."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = socket.socket(self.family, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.sockaddr)
+            except OSError:
+                conn.close()
+                raise
+            self.local.conn = conn
+        return conn
+
+    def disconnect(self) -> None:
+        if (conn := getattr(self.local, "conn", None)) is not None:
+            conn.close()
+            self.local.conn = None
+
+    def recv_exactly(self, conn: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("Cache sidecar closed the connection.")
+            buf += chunk
+        return bytes(buf)
+
+    def request(self, header: dict, body: bytes = b"") -> tuple[dict, bytes] | None:
+        """Sends one request, returning the response or None if the sidecar couldn't be reached."""
+        if not self.available:
+            return None
+
+        try:
+            conn = self.connection()
+            conn.sendall(pack(header, body))
+            header_len, body_len = FRAME.unpack(self.recv_exactly(conn, FRAME.size))
+            response = json.loads(self.recv_exactly(conn, header_len))
+            return response, self.recv_exactly(conn, body_len)
+        except (OSError, ValueError) as e:
+            self.disconnect()
+            self.errors += 1
+            if time.monotonic() >= self.down_until:
+                log.warning(f"Cache sidecar at {self.address} is unavailable, using only local caches: {e}")
+            self.down_until = time.monotonic() + self.retry_after
+            return None
+
+    def get(self, key: str) -> bytes | None:
+        """Gets a value, or None if it isn't cached or the sidecar is unavailable."""
+        if not self.enabled:
+            return None
+
+        response = self.request({"op": "get", "key": key})
+        kind = key.split(":", 1)[0]
+        if response is None:
+            CACHE_REQUESTS.inc(cache=f"shared_{kind}", result="error")
+            return None
+
+        header, body = response
+        CACHE_REQUESTS.inc(cache=f"shared_{kind}", result="hit" if header.get("hit") else "miss")
+        return body if header.get("hit") else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Caches a value for `ttl` seconds, silently doing nothing if the sidecar is unavailable."""
+        if not self.enabled or ttl <= 0 or len(value) > MAX_VALUE_BYTES:
+            return
+        self.request({"op": "set", "key": key, "ttl": ttl}, value)
+
+    def get_json(self, key: str) -> Any | None:
+        if (value := self.get(key)) is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def set_json(self, key: str, value: Any, ttl: float) -> None:
+        if self.enabled:
+            self.set(key, json.dumps(value, separators=(",", ":")).encode(), ttl)
+
+    def get_frame(self, key: str) -> pd.DataFrame | None:
+        if (value := self.get(key)) is None:
+            return None
+        try:
+            return decode_frame(value)
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"Ignoring unreadable candles {key} from the cache sidecar: {e}")
+            return None
+
+    def set_frame(self, key: str, df: pd.DataFrame, ttl: float) -> None:
+        if self.enabled:
+            self.set(key, encode_frame(df), ttl)
+
+    def status(self) -> str:
+        """Human readable state of the sidecar for `/status`."""
+        if not self.enabled:
+            return "Shared cache is not configured."
+
+        response = self.request({"op": "stats"})
+        if response is None:
+            return f"Shared cache at {self.address} is unavailable, using local caches."
+
+        stats = response[0]
+        return (
+            f"Shared cache has {stats['entries']:,} entries using {stats['bytes'] / 1024**2:.1f}MB"
+            f" with a {stats['hit_rate']:.0%} hit rate."
+        )
+
+
+# Shared by everything in the process, disabled unless SHARED_CACHE is set.
+shared_cache = SharedCache()
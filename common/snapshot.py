@@ -0,0 +1,121 @@
+"""Local snapshots of downloaded data so the bots can start without waiting on a download.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Callable
+
+import requests as r
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".cache", "simple-stock-bot"))
+
+
+class Snapshot:
+    """
+    Gzipped JSON copy of a download, along with the validators needed to only download it again when it has changed.
+    """
+
+    def __init__(self, name: str, directory: str = SNAPSHOT_DIR) -> None:
+        self.path = os.path.join(directory, f"{name}.json.gz")
+
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.digest: str | None = None
+
+    def load(self) -> Any | None:
+        """Loads the snapshot from disk.
+
+        Returns
+        -------
+        Any | None
+            Data that was saved, or None if there is no usable snapshot.
+        """
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return None
+
+        self.etag = snapshot.get("etag")
+        self.last_modified = snapshot.get("last_modified")
+        self.digest = snapshot.get("digest")
+
+        age = time.time() - snapshot.get("saved", 0)
+        log.info(f"Loaded snapshot {self.path} that is {age / 3600:.1f} hours old.")
+        return snapshot["data"]
+
+    def save(self, data: Any) -> None:
+        """Writes the snapshot to a temporary file then moves it into place, so readers never see a partial file."""
+        snapshot = {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "digest": self.digest,
+            "saved": time.time(),
+            "data": data,
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"Failed to save snapshot {self.path}: {e}")
+
+    def conditional_headers(self) -> dict:
+        """Headers that let the server answer 304 Not Modified if the download hasn't changed."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def refresh(self, fetch: Callable[[dict], r.Response]) -> Any | None:
+        """Downloads the data again if it has changed and saves it.
+
+        Parameters
+        ----------
+        fetch : Callable[[dict], r.Response]
+            Makes the request with the headers it is passed.
+
+        Returns
+        -------
+        Any | None
+            The new data, or None if it is unchanged or the download failed.
+        """
+        try:
+            resp = fetch(self.conditional_headers())
+            if resp.status_code == 304:
+                log.info(f"{self.path} is up to date.")
+                return None
+            resp.raise_for_status()
+            data = resp.json()
+        except (r.exceptions.RequestException, ValueError) as e:
+            log.error(f"Failed to refresh {self.path}: {e}")
+            return None
+
+        self.etag = resp.headers.get("ETag")
+        self.last_modified = resp.headers.get("Last-Modified")
+
+        # Some servers don't send validators, so compare the content as well.
+        digest = hashlib.sha256(resp.content).hexdigest()
+        if digest == self.digest:
+            log.info(f"{self.path} is unchanged.")
+            return None
+
+        self.digest = digest
+        self.save(data)
+        return data
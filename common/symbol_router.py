@@ -3,49 +3,60 @@
 
 import datetime
 import logging
+import os
 import random
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict
 
+import humanize
 import pandas as pd
-import schedule
-from cachetools import TTLCache, cached
 
+from common import metrics
+from common.cashtags import find_cashtags
 from common.cg_Crypto import cg_Crypto
 from common.MarketData import MarketData
+from common.scheduler import scheduler
+from common.search_index import SearchIndex
+from common.shared_cache import shared_cache
 from common.Symbol import Coin, Stock, Symbol
+from common.trending import DecayedCounter
 
 log = logging.getLogger(__name__)
 
 
 class Router:
-    STOCK_REGEX = "(?:^|[^\\$])\\$([a-zA-Z.]{1,6})"
-    CRYPTO_REGEX = "[$]{2}([a-zA-Z]{1,20})"
-    trending_count: Dict[str, float] = {}
-
-    def __init__(self):
+    def __init__(self, name: str = "bot"):
+        """
+        Parameters
+        ----------
+        name : str, optional
+            Name of the bot using the router, keeps each bots saved trending counts separate.
+        """
         self.stock = MarketData()
         self.crypto = cg_Crypto()
 
-        schedule.every().hour.do(self.trending_decay)
-
-    def trending_decay(self, decay=0.5):
-        """Decays the value of each trending stock by a multiplier"""
-        t_copy = {}
-        dead_keys = []
-        if self.trending_count:
-            t_copy = self.trending_count.copy()
-            for key in t_copy.keys():
-                if t_copy[key] < 0.01:
-                    # Prune Keys
-                    dead_keys.append(key)
-                else:
-                    t_copy[key] = t_copy[key] * decay
-        for dead in dead_keys:
-            t_copy.pop(dead)
-
-        self.trending_count = t_copy.copy()
-        log.info("Decayed trending symbols.")
+        self._search_index: SearchIndex | None = None
+        self._search_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="router")
+        # Telegram drops inline answers that take too long, so inline prices are only waited on for this many seconds.
+        self.inline_deadline = float(os.environ.get("INLINE_DEADLINE", 3))
+
+        # Counts of symbols people ask about halve every hour, and are saved so deploys don't reset them.
+        self.trending_count = DecayedCounter(half_life=3600, k=5, snapshot=f"{name}_trending")
+
+        # Trending is built in the background and the last good reply is served straight away.
+        self.trending_reply: str | None = None
+        self.trending_updated: float | None = None
+        self.trending_lock = threading.Lock()
+        self.trending_interval = int(os.environ.get("TRENDING_INTERVAL", 600))
+
+        metrics.gauge("trending_age_seconds", "Seconds since trending was last refreshed successfully.").track(self.trending_age)
+
+        scheduler.every(5 * 60, self.trending_count.save, name="trending_snapshot")
+        scheduler.every(self.trending_interval, self.refresh_trending, name="trending", immediately=True)
 
     def find_symbols(self, text: str, *, trending_weight: int = 1) -> list[Stock | Coin]:
         """Finds stock tickers starting with a dollar sign, and cryptocurrencies with two dollar signs
@@ -61,29 +72,23 @@ class Router:
         list[Symbol]
             List of stock symbols as Symbol objects
         """
-        schedule.run_pending()
-
         symbols: list[Symbol] = []
-        stock_matches = set(re.findall(self.STOCK_REGEX, text))
-        coin_matches = set(re.findall(self.CRYPTO_REGEX, text))
+        stock_matches, coin_matches = find_cashtags(text)
 
         for stock_match in stock_matches:
             # Market data lacks tools to check if a symbol is valid.
-            if stock_info := self.stock.symbol_id(stock_match):
-                symbols.append(Stock(stock_info))
+            if stock := self.stock.lookup(stock_match):
+                symbols.append(stock)
             else:
                 log.info(f"{stock_match} is not in list of stocks")
 
         for coin_match in coin_matches:
-            sym = self.crypto.symbol_list[self.crypto.symbol_list["symbol"].str.fullmatch(coin_match.lower(), case=False)]
-            if sym.empty:
-                log.info(f"{coin_match} is not in list of coins")
+            if coin := self.crypto.lookup(coin_match):
+                symbols.append(coin)
             else:
-                symbols.append(Coin(sym))
-        if symbols:
-            for symbol in symbols:
-                self.trending_count[symbol.tag] = self.trending_count.get(symbol.tag, 0) + trending_weight
-                log.debug(self.trending_count)
+                log.info(f"{coin_match} is not in list of coins")
+        for symbol in symbols:
+            self.trending_count.add(symbol.tag, trending_weight)
 
         return symbols
 
@@ -105,15 +110,40 @@ class Router:
 
         Cryptocurrency Data:
         {self.crypto.status()}
+
+        Trending refreshed: {"never" if (age := self.trending_age()) is None else humanize.naturaltime(age)}
+
+        {shared_cache.status()}
         """
 
+        for name, job in scheduler.stats().items():
+            if job["failures"]:
+                stats += f"\n        Job {name} has failed {job['failures']} of {job['runs']} runs: {job['last_error']}"
+
         log.warning(stats)
 
         return stats
 
+    def search_index(self) -> SearchIndex:
+        """Returns the search index for the current symbol lists, rebuilding it if either list has been refreshed.
+        The new index is swapped in only once it is fully built, so searches never see a partial index.
+        """
+        sources = (self.stock.symbol_list, self.crypto.coins)
+        index = self._search_index
+
+        if index is None or any(a is not b for a, b in zip(index.sources, sources)):
+            with self._search_lock:
+                index = self._search_index
+                if index is None or any(a is not b for a, b in zip(index.sources, sources)):
+                    index = SearchIndex.from_symbol_lists(*sources)
+                    self._search_index = index
+                    log.info(f"Built search index of {len(index)} symbols.")
+
+        return index
+
     def inline_search(self, search: str, matches: int = 5) -> pd.DataFrame:
-        """Searches based on the shortest symbol that contains the same string as the search.
-        Should be very fast compared to a fuzzy search.
+        """Searches stock and crypto symbols and names, ranking exact symbol matches first,
+            then symbols and names that start with the search.
 
         Parameters
         ----------
@@ -122,23 +152,57 @@ class Router:
 
         Returns
         -------
-        list[tuple[str, str]]
-            Each tuple contains: (Symbol, Issue Name).
+        pd.DataFrame
+            Has the columns: type_id, description, and price_reply.
         """
 
-        # df = pd.concat([self.stock.symbol_list, self.crypto.symbol_list])
-        df = self.crypto.symbol_list
+        results = self.search_index().search(search, matches)
+        prices = self.batch_price_map([symbol for _, _, symbol in results], deadline=self.inline_deadline)
 
-        df = df[df["description"].str.contains(search, regex=False, case=False)].sort_values(
-            by="type_id", key=lambda x: x.str.len()
+        # Results that weren't priced in time send their cashtag so the bot can reply with the price instead.
+        return pd.DataFrame(
+            [(type_id, description, prices.get(symbol, description)) for type_id, description, symbol in results],
+            columns=["type_id", "description", "price_reply"],
         )
 
-        symbols = df.head(matches)
-        symbols["price_reply"] = symbols["type_id"].apply(
-            lambda sym: self.price_reply(self.find_symbols(sym, trending_weight=0))[0]
-        )
+    def batch_price_map(self, symbols: list[Symbol], deadline: float | None = None) -> Dict[Symbol, str]:
+        """Prices stocks and coins with one batched request each, run concurrently.
 
-        return symbols
+        Parameters
+        ----------
+        symbols : list[Symbol]
+        deadline : float, optional
+            Seconds to wait for prices. Batches that don't finish in time are left out of the result.
+                Ones that already started keep running so their quotes get cached, and ones still waiting
+                for a worker are cancelled so a slow upstream can't back up the pool for later queries.
+
+        Returns
+        -------
+        Dict[Symbol, str]
+            Price reply for each symbol that was priced before the deadline.
+        """
+        stocks = [s for s in symbols if isinstance(s, Stock)]
+        coins = [s for s in symbols if isinstance(s, Coin)]
+
+        batches = {}
+        if stocks:
+            batches[self.executor.submit(self.stock.batch_price, stocks)] = stocks
+        if coins:
+            batches[self.executor.submit(self.crypto.batch_price, coins)] = coins
+
+        done, not_done = wait(batches, timeout=deadline)
+        if not_done:
+            cancelled = sum(batch.cancel() for batch in not_done)
+            log.info(f"{len(not_done)} price batches missed the {deadline} second deadline, {cancelled} hadn't started.")
+
+        prices = {}
+        for batch in done:
+            try:
+                prices.update(zip(batches[batch], batch.result()))
+            except Exception as e:
+                log.warning(e)
+
+        return prices
 
     def price_reply(self, symbols: list[Symbol]) -> list[str]:
         """Returns current market price or after hours if its available for a given stock symbol.
@@ -316,14 +380,13 @@ class Router:
 
         return replies
 
-    @cached(cache=TTLCache(maxsize=1024, ttl=600))
-    def trending(self) -> str:
+    def build_trending(self) -> str | None:
         """Checks APIs for trending symbols.
 
         Returns
         -------
-        list[str]
-            List of preformatted strings to be sent to user.
+        str | None
+            Preformatted reply to be sent to user, or None if no trending data could be collected.
         """
 
         # stocks = self.stock.trending()
@@ -331,15 +394,14 @@ class Router:
 
         reply = ""
 
-        log.warning(self.trending_count)
-        if self.trending_count:
+        if sorted_trending := [tag for tag, _ in self.trending_count.top(5)]:
             reply += "🔥Trending on the Stock Bot:\n`"
             reply += "━" * len("Trending on the Stock Bot:") + "`\n"
 
-            sorted_trending = [s[0] for s in sorted(self.trending_count.items(), key=lambda item: item[1])][::-1][0:5]
-            log.warning(sorted_trending)
             for t in sorted_trending:
-                reply += self.spark_reply(self.find_symbols(t))[0] + "\n"
+                # Share classes are tagged with a dash, ie: $BRK-B, but only parsed from chat with a dot.
+                if symbols := self.find_symbols(t.replace("-", "."), trending_weight=0):
+                    reply += self.spark_reply(symbols)[0] + "\n"
 
         if coins:
             reply += "\n\n🦎Trending on CoinGecko:\n`"
@@ -350,12 +412,52 @@ class Router:
         if "`$GME" in reply:
             reply = reply.replace("🔥", "🦍")
 
-        if reply:
-            return reply
-        else:
-            log.warning("Failed to collect trending data.")
+        return reply or None
+
+    def refresh_trending(self) -> None:
+        """Builds the trending reply and keeps it if it succeeded, otherwise the last good reply is kept."""
+        with self.trending_lock:
+            start = time.perf_counter()
+            try:
+                reply = self.build_trending()
+            except Exception as e:
+                log.error(f"Failed to refresh trending: {e}")
+                return
+
+            if reply:
+                self.trending_updated = time.time()
+                self.trending_reply = reply
+                log.info(f"Refreshed trending in {time.perf_counter() - start:.2f} seconds.")
+            else:
+                log.warning("Failed to collect trending data.")
+
+    def trending_age(self) -> float | None:
+        """Seconds since trending was last refreshed successfully, or None if it never has been."""
+        if self.trending_updated is None:
+            return None
+        return time.time() - self.trending_updated
+
+    def trending(self) -> str:
+        """Returns the last trending reply that was collected along with how old it is.
+
+        Returns
+        -------
+        str
+            Preformatted string to be sent to user.
+        """
+        if self.trending_reply is None:
+            # Only happens before the first refresh has finished, this waits on it rather than starting another.
+            with self.trending_lock:
+                pass
+            if self.trending_reply is None:
+                self.refresh_trending()
+
+        reply, age = self.trending_reply, self.trending_age()
+        if reply is None or age is None:
             return "Trending data is not currently available."
 
+        return reply + f"\n_Updated {humanize.naturaltime(age)}._"
+
     def random_pick(self) -> str:
         # choice = random.choice(list(self.stock.symbol_list["description"]) + list(self.crypto.symbol_list["description"]))
         choice = random.choice(list(self.crypto.symbol_list["description"]))
@@ -390,8 +492,7 @@ class Router:
                 log.debug(f"{symbol} is not a Stock or Coin")
 
         if stocks:
-            for stock in stocks:
-                replies.append(self.stock.price_reply(stock))
+            replies = replies + self.stock.batch_price(stocks)
         if coins:
             replies = replies + self.crypto.batch_price(coins)
 
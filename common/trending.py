@@ -0,0 +1,180 @@
+"""Time decayed counts of the symbols people ask the bot about.
+"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from common.snapshot import Snapshot
+
+log = logging.getLogger(__name__)
+
+
+class DecayedCounter:
+    """
+    Counts that halve every `half_life` seconds, with the top `k` keys kept ready to read.
+
+    Decay is applied lazily, each key stores its value and when it was last counted, and is only decayed
+        when it is counted again or read. Since every key decays at the same rate, keys are ranked by
+        log(value) + decay * timestamp, which doesn't change until the key is counted again.
+        That lets the top keys be kept in a min-heap of size `k` instead of sorting every key.
+    """
+
+    def __init__(
+        self,
+        half_life: float = 3600,
+        k: int = 5,
+        min_value: float = 0.01,
+        max_keys: int = 10_000,
+        snapshot: str | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        half_life : float, optional
+            Seconds it takes a count to decay to half its value, by default an hour.
+        k : int, optional
+            Number of top keys kept, by default 5
+        min_value : float, optional
+            Keys that decay below this are pruned, by default 0.01
+        max_keys : int, optional
+            Most keys tracked, the least recently counted are dropped first, by default 10,000
+        snapshot : str, optional
+            Name of the snapshot the counts are saved to and loaded from, counts aren't saved if not set.
+        """
+        self.decay = math.log(2) / half_life
+        self.k = k
+        self.min_value = min_value
+        self.max_keys = max_keys
+
+        # key: (value, timestamp), ordered from least to most recently counted.
+        self.counts: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        # key: rank of the current top keys, and a min-heap of (rank, key) that may hold stale entries.
+        self.top_ranks: dict[str, float] = {}
+        self.heap: list[tuple[float, str]] = []
+        self.lock = threading.Lock()
+
+        self.snapshot = Snapshot(snapshot) if snapshot else None
+        if self.snapshot:
+            self.load()
+
+    def rank(self, value: float, timestamp: float) -> float:
+        return math.log(value) + self.decay * timestamp
+
+    def value(self, key: str, now: float | None = None) -> float:
+        """Current decayed value of a key, 0 if it isn't tracked."""
+        now = time.time() if now is None else now
+        if (count := self.counts.get(key)) is None:
+            return 0.0
+        value, timestamp = count
+        return value * math.exp(-self.decay * (now - timestamp))
+
+    def add(self, key: str, weight: float = 1, now: float | None = None) -> None:
+        """Counts a key.
+
+        Parameters
+        ----------
+        key : str
+        weight : float, optional
+            Amount added to the keys count, by default 1
+        """
+        if weight <= 0:
+            return
+
+        now = time.time() if now is None else now
+        with self.lock:
+            value = self.value(key, now) + weight
+            self.counts[key] = (value, now)
+            self.counts.move_to_end(key)
+            self.promote(key, self.rank(value, now))
+            self.prune(now)
+
+    def promote(self, key: str, rank: float) -> None:
+        """Adds a key to the top keys if its rank is high enough. Ranks only ever go up, so a top key
+        that is counted again stays in the top keys and its old heap entry is left to be skipped later.
+        """
+        self.clean_heap()
+        if key not in self.top_ranks and len(self.top_ranks) >= self.k:
+            if rank <= self.heap[0][0]:
+                return
+            _, evicted = heapq.heappop(self.heap)
+            del self.top_ranks[evicted]
+
+        self.top_ranks[key] = rank
+        heapq.heappush(self.heap, (rank, key))
+
+        # Stale entries are dropped as they reach the top of the heap, this stops them piling up under it.
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(r, key) for key, r in self.top_ranks.items()]
+            heapq.heapify(self.heap)
+
+    def clean_heap(self) -> None:
+        while self.heap and self.top_ranks.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def remove(self, key: str) -> None:
+        del self.counts[key]
+        if self.top_ranks.pop(key, None) is not None:
+            self.clean_heap()
+
+    def prune(self, now: float) -> None:
+        """Drops cold keys from the least recently counted end, stopping at the first key that is still warm."""
+        while len(self.counts) > self.max_keys:
+            key = next(iter(self.counts))
+            if key in self.top_ranks and len(self.counts) > self.k:
+                self.counts.move_to_end(key)
+                continue
+            self.remove(key)
+
+        while self.counts:
+            key = next(iter(self.counts))
+            if self.value(key, now) >= self.min_value:
+                break
+            self.remove(key)
+
+    def top(self, n: int | None = None, now: float | None = None) -> list[tuple[str, float]]:
+        """The highest counted keys.
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of keys, at most and by default `k`
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            Keys and their decayed values, highest first.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            ranked = heapq.nlargest(n or self.k, self.top_ranks.items(), key=lambda item: item[1])
+            top = [(key, self.value(key, now)) for key, _ in ranked]
+        return [(key, value) for key, value in top if value >= self.min_value]
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def save(self) -> None:
+        """Saves the counts to the snapshot."""
+        if not self.snapshot:
+            return
+        with self.lock:
+            data = [[key, value, timestamp] for key, (value, timestamp) in self.counts.items()]
+        self.snapshot.save(data)
+
+    def load(self) -> None:
+        """Loads counts from the snapshot, decaying them by the time that has passed since they were saved."""
+        data = self.snapshot.load() if self.snapshot else None
+        if not data:
+            return
+
+        now = time.time()
+        with self.lock:
+            for key, value, timestamp in sorted(data, key=lambda count: count[2]):
+                self.counts[key] = (value, timestamp)
+                self.promote(key, self.rank(value, timestamp))
+            self.prune(now)
+        log.info(f"Loaded {len(self.counts)} trending counts.")
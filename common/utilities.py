@@ -1,31 +1,233 @@
-import time
+import asyncio
+import copy
+import fcntl
+import functools
+import json
 import logging
+import os
+import threading
+import time
+
+from common import metrics
 
 log = logging.getLogger(__name__)
 
+RATE_LIMIT_WAIT = metrics.histogram("rate_limit_wait_seconds", "Time spent waiting on rate limits.", ["bucket"])
+SINGLEFLIGHT_CALLS = metrics.counter(
+    "singleflight_calls", "Requests that ran, or shared the result of an identical request in flight.", ["name", "result"]
+)
 
-def rate_limited(max_per_second):
+
+class TokenBucket:
     """
-    Decorator that ensures the wrapped function is called at most `max_per_second` times per second.
+    Token bucket that allows short bursts while keeping the long term rate at `rate` per second.
+
+    When a `path` is given the bucket state is kept in that file and guarded with `flock`,
+        so every process that points at the same file draws from one shared budget.
+        This lets the Telegram and Discord containers use each others idle capacity.
     """
-    min_interval = 1.0 / max_per_second
 
-    def decorate(func):
-        last_called = [0.0]
+    def __init__(self, rate: float, capacity: float = 1, path: str | None = None, name: str = "default") -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self.name = name
 
-        def rate_limited_function(*args, **kwargs):
-            elapsed = time.time() - last_called[0]
-            left_to_wait = min_interval - elapsed
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.time()
+
+    def _load(self, fd) -> None:
+        try:
+            state = json.loads(os.pread(fd, 256, 0) or b"{}")
+            self._tokens = state["tokens"]
+            self._updated = state["updated"]
+        except (ValueError, KeyError):
+            self._tokens = self.capacity
+            self._updated = time.time()
+
+    def _save(self, fd) -> None:
+        state = json.dumps({"tokens": self._tokens, "updated": self._updated}).encode()
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, state, 0)
+
+    def _update(self, func):
+        """Runs `func` against the bucket state while holding both the thread and file locks."""
+        with self._lock:
+            if self.path is None:
+                return func()
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._load(fd)
+                ret = func()
+                self._save(fd)
+                return ret
+            finally:
+                os.close(fd)
+
+    def _refill(self) -> None:
+        now = time.time()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Takes a token from the bucket, going into debt if none are available.
+
+        Returns
+        -------
+        float
+            Seconds the caller must wait before using the token.
+        """
+
+        def take():
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+        return self._update(take)
+
+    def penalize(self, seconds: float) -> None:
+        """Empties the bucket so no tokens are available for `seconds`. Used when an API returns 429."""
+
+        def drain():
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+        self._update(drain)
+
+    def acquire(self) -> float:
+        """Blocks the current thread until a token is available. Never call from the event loop."""
+        wait = self.reserve()
+        RATE_LIMIT_WAIT.observe(wait, bucket=self.name)
+        if wait > 0:
+            log.info(f"Rate limit exceeded. Waiting for {wait:.2f} seconds.")
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """Waits for a token without blocking the event loop."""
+        wait = self.reserve()
+        RATE_LIMIT_WAIT.observe(wait, bucket=self.name)
+        if wait > 0:
+            log.info(f"Rate limit exceeded. Waiting for {wait:.2f} seconds.")
+            await asyncio.sleep(wait)
+        return wait
+
+
+def rate_limited(max_per_second: float, burst: float = 1, name: str | None = None):
+    """
+    Decorator that ensures the wrapped function is called at most `max_per_second` times per second,
+        while still allowing `burst` calls back to back after being idle.
 
-            if left_to_wait > 0:
-                log.info(f"Rate limit exceeded. Waiting for {left_to_wait:.2f} seconds.")
-                time.sleep(left_to_wait)
+    Coroutine functions await their turn, regular functions sleep the thread they are called from.
+        If `name` is set and the `RATE_LIMIT_DIR` environment variable points to a directory shared
+        between bots, the limit is shared through a lock file in that directory.
+    """
+    path = None
+    if name and (rate_dir := os.environ.get("RATE_LIMIT_DIR")):
+        os.makedirs(rate_dir, exist_ok=True)
+        path = os.path.join(rate_dir, f"{name}.bucket")
+
+    bucket = TokenBucket(max_per_second, burst, path, name or "default")
+
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_rate_limited_function(*args, **kwargs):
+                await bucket.acquire_async()
+                return await func(*args, **kwargs)
 
-            ret = func(*args, **kwargs)
-            last_called[0] = time.time()
+            async_rate_limited_function.bucket = bucket
+            return async_rate_limited_function
 
-            return ret
+        @functools.wraps(func)
+        def rate_limited_function(*args, **kwargs):
+            bucket.acquire()
+            return func(*args, **kwargs)
 
+        rate_limited_function.bucket = bucket
         return rate_limited_function
 
     return decorate
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that are in flight at the same time into one call.
+
+    The first caller for a key runs the function, every caller that arrives with the same key
+        before it finishes waits and receives a copy of the same result instead of making its own call.
+    """
+
+    class _Call:
+        def __init__(self) -> None:
+            self.done = threading.Event()
+            self.waiters = 0
+            self.result = None
+            self.error: BaseException | None = None
+
+    def __init__(self, name: str = "default") -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+
+        self.calls = 0  # Calls that actually ran
+        self.shared = 0  # Calls that were saved by sharing a result
+
+    def do(self, key, func, *args, **kwargs):
+        """Runs `func(*args, **kwargs)` unless a call with the same `key` is already running.
+
+        Parameters
+        ----------
+        key : Hashable
+            Identifies calls that would return the same result.
+        func : Callable
+            Function to call.
+
+        Returns
+        -------
+        Any
+            Result of the call. Callers that share a call each get their own copy so they can mutate it.
+        """
+        with self._lock:
+            if call := self._calls.get(key):
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = self._Call()
+                self.calls += 1
+                leader = True
+
+        SINGLEFLIGHT_CALLS.inc(name=self.name, result="ran" if leader else "shared")
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                waiters = call.waiters
+            call.done.set()
+
+        return copy.deepcopy(call.result) if waiters else call.result
+
+    def stats(self) -> dict:
+        """Counts of calls made and calls saved by sharing."""
+        return {"calls": self.calls, "shared": self.shared}
+
+
+def request_key(endpoint: str, params: dict | None) -> tuple:
+    """Hashable key for an API request so identical requests can be recognized."""
+    return (endpoint, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
@@ -34,6 +34,7 @@ Type any symbol, and the bot shows its price. Like: `Is $$btc rising since $tsla
 - `/intra $[symbol]`: See stock's latest movement. 📈
 - `/chart $[symbol]`: View a month's stock activity. 📊
 - `/trending`: Check trending stocks and cryptos. 💬
+- `/window [seconds]`: How often a symbol is answered in this channel. ⏱️
 - `/help`: Need help? Ask here. 🆘
 
 **Inline Features**
@@ -1,20 +1,38 @@
+import asyncio
 import datetime
 import io
 import logging
 import os
+import time
 
-import mplfinance as mpf
 import nextcord
 from D_info import D_info
 from nextcord.ext import commands
 
+from common import metrics
+from common.chart_renderer import ChartQueueFull, ChartRenderer
+from common.metrics import HANDLER_SECONDS
+from common.reply_window import MAX_WINDOW, ReplyWindow
+from common.scheduler import scheduler
 from common.symbol_router import Router
 
 DISCORD_TOKEN = os.environ["DISCORD"]
 
-s = Router()
-d = D_info()
+# Chart workers run this script again as __mp_main__ when they start, where they only need the commands defined.
+if __name__ != "__mp_main__":
+    renderer = ChartRenderer()
+    renderer.start()
+
+    s = Router("discord")
+    reply_window = ReplyWindow("discord")
 
+    logger = logging.getLogger("nextcord")
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(filename="nextcord.log", encoding="utf-8", mode="w")
+    handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
+    logger.addHandler(handler)
+
+d = D_info()
 
 intents = nextcord.Intents.default()
 
@@ -22,17 +40,24 @@ intents = nextcord.Intents.default()
 client = nextcord.Client(intents=intents)
 bot = commands.Bot(command_prefix="/", description=d.help_text, intents=intents)
 
-logger = logging.getLogger("nextcord")
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(filename="nextcord.log", encoding="utf-8", mode="w")
-handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
-logger.addHandler(handler)
-
 
 @bot.event
 async def on_ready():
     logging.info("Starting Simple Stock Bot")
     logging.info(f"Logged in as {bot.user.name} {bot.user.id}")
+    scheduler.start()
+    metrics.serve()
+
+
+@bot.before_invoke
+async def start_timer(ctx: commands.Context):
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_time(ctx: commands.Context):
+    """Records how long each command took, after_invoke runs even if the command raised."""
+    HANDLER_SECONDS.observe(time.perf_counter() - ctx.started, bot="discord", command=ctx.command.qualified_name)
 
 
 @bot.command()
@@ -42,7 +67,8 @@ async def status(ctx: commands):
     message = ""
     try:
         message = "Contact MisterBiggs#0465 if you need help.\n"
-        message += s.status(f"Bot recieved your message in: {bot.latency*10:.4f} seconds") + "\n"
+        message += await asyncio.to_thread(s.status, f"Bot recieved your message in: {bot.latency*10:.4f} seconds")
+        message += "\n"
 
     except Exception as ex:
         logging.critical(ex)
@@ -85,7 +111,7 @@ async def crypto(ctx: commands, _: str):
 @bot.command()
 async def intra(ctx: commands, sym: str):
     """Get a chart for the stocks movement since market open."""
-    symbols = s.find_symbols(sym)
+    symbols = await asyncio.to_thread(s.find_symbols, sym)
 
     if len(symbols):
         symbol = symbols[0]
@@ -93,25 +119,29 @@ async def intra(ctx: commands, sym: str):
         await ctx.send("No symbols or coins found.")
         return
 
-    df = s.intra_reply(symbol)
+    df = await asyncio.to_thread(s.intra_reply, symbol)
     if df.empty:
         await ctx.send("Invalid symbol please see `/help` for usage details.")
         return
     with ctx.channel.typing():
-        buf = io.BytesIO()
-        mpf.plot(
-            df,
-            type="renko",
-            title=f"\n{symbol.name}",
-            volume="volume" in df.keys(),
-            style="yahoo",
-            savefig=dict(fname=buf, dpi=400, bbox_inches="tight"),
-        )
-
-        buf.seek(0)
+        try:
+            png = await renderer.render(
+                df,
+                type="renko",
+                title=f"\n{symbol.name}",
+                volume="volume" in df.keys(),
+                key=renderer.chart_key(symbol, "renko", "intra", df),
+            )
+            buf = io.BytesIO(png)
+        except ChartQueueFull:
+            await ctx.send("The bot is busy drawing other charts, please try again in a few seconds.")
+            return
+        except TimeoutError:
+            await ctx.send("The chart took too long to draw, please try again in a few seconds.")
+            return
 
         # Get price so theres no request lag after the image is sent
-        price_reply = s.price_reply([symbol])[0]
+        price_reply = (await asyncio.to_thread(s.price_reply, [symbol]))[0]
         await ctx.send(
             file=nextcord.File(
                 buf,
@@ -127,7 +157,7 @@ async def intra(ctx: commands, sym: str):
 async def chart(ctx: commands, sym: str):
     """returns a chart of the past month of data for a symbol"""
 
-    symbols = s.find_symbols(sym)
+    symbols = await asyncio.to_thread(s.find_symbols, sym)
 
     if len(symbols):
         symbol = symbols[0]
@@ -135,24 +165,29 @@ async def chart(ctx: commands, sym: str):
         await ctx.send("No symbols or coins found.")
         return
 
-    df = s.chart_reply(symbol)
+    df = await asyncio.to_thread(s.chart_reply, symbol)
     if df.empty:
         await ctx.send("Invalid symbol please see `/help` for usage details.")
         return
     with ctx.channel.typing():
-        buf = io.BytesIO()
-        mpf.plot(
-            df,
-            type="candle",
-            title=f"\n{symbol.name}",
-            volume="volume" in df.keys(),
-            style="yahoo",
-            savefig=dict(fname=buf, dpi=400, bbox_inches="tight"),
-        )
-        buf.seek(0)
+        try:
+            png = await renderer.render(
+                df,
+                type="candle",
+                title=f"\n{symbol.name}",
+                volume="volume" in df.keys(),
+                key=renderer.chart_key(symbol, "candle", "1M", df),
+            )
+            buf = io.BytesIO(png)
+        except ChartQueueFull:
+            await ctx.send("The bot is busy drawing other charts, please try again in a few seconds.")
+            return
+        except TimeoutError:
+            await ctx.send("The chart took too long to draw, please try again in a few seconds.")
+            return
 
         # Get price so theres no request lag after the image is sent
-        price_reply = s.price_reply([symbol])[0]
+        price_reply = (await asyncio.to_thread(s.price_reply, [symbol]))[0]
         await ctx.send(
             file=nextcord.File(
                 buf,
@@ -167,10 +202,10 @@ async def chart(ctx: commands, sym: str):
 @bot.command()
 async def cap(ctx: commands, sym: str):
     """Get the market cap of a symbol"""
-    symbols = s.find_symbols(sym)
+    symbols = await asyncio.to_thread(s.find_symbols, sym)
     if symbols:
         with ctx.channel.typing():
-            for reply in s.cap_reply(symbols):
+            for reply in await asyncio.to_thread(s.cap_reply, symbols):
                 await ctx.send(reply)
 
 
@@ -178,7 +213,32 @@ async def cap(ctx: commands, sym: str):
 async def trending(ctx: commands):
     """Get a list of Trending Stocks and Coins"""
     with ctx.channel.typing():
-        await ctx.send(s.trending())
+        await ctx.send(await asyncio.to_thread(s.trending))
+
+
+@bot.command()
+async def window(ctx: commands, seconds: str = None):
+    """Show or change how long a symbol goes unanswered in this channel after its price was posted."""
+    if seconds is None:
+        await ctx.send(
+            f"Symbols mentioned again within `{reply_window.window(ctx.channel.id):g}` seconds of being answered aren't"
+            + " answered again in this channel.\nChange it with `/window [seconds]`, `/window 0` answers every mention."
+        )
+        return
+
+    if ctx.guild is not None and not ctx.channel.permissions_for(ctx.author).manage_messages:
+        await ctx.send("Only members who can manage messages can change the window.")
+        return
+
+    try:
+        reply_window.set_window(ctx.channel.id, float(seconds))
+    except ValueError:
+        await ctx.send(f"The window must be a number of seconds between 0 and {MAX_WINDOW}.")
+        return
+
+    await ctx.send(
+        f"Symbols will be answered at most once every `{reply_window.window(ctx.channel.id):g}` seconds in this channel."
+    )
 
 
 @bot.event
@@ -187,31 +247,41 @@ async def on_message(message):
     if message.author.id == bot.user.id:
         return
 
-    content_lower = message.content.lower()
-
     # Process commands starting with "/"
     if message.content.startswith("/"):
         await bot.process_commands(message)
         return
 
+    await symbol_detect(message)
+
+
+@metrics.timed(HANDLER_SECONDS, bot="discord", command="symbol_detect")
+async def symbol_detect(message):
+    content_lower = message.content.lower()
+
     symbols = None
     if "$" in message.content:
-        symbols = s.find_symbols(message.content)
+        symbols = await asyncio.to_thread(s.find_symbols, message.content)
 
     if "call" in content_lower or "put" in content_lower:
         await handle_options(message, symbols)
         return
 
-    if symbols:
-        for reply in s.price_reply(symbols):
-            await message.channel.send(reply)
+    # Symbols that were just answered in this channel aren't answered again.
+    if symbols and (symbols := reply_window.claim(message.channel.id, symbols)):
+        try:
+            for reply in await asyncio.to_thread(s.batch_price_reply, symbols):
+                await message.channel.send(reply)
+        except Exception:
+            reply_window.release(message.channel.id, symbols)
+            raise
         return
 
 
 async def handle_options(message, symbols):
     logging.info("Options detected")
     try:
-        options_data = s.options(message.content.lower(), symbols)
+        options_data = await asyncio.to_thread(s.options, message.content.lower(), symbols)
 
         # Create the embed directly within the function
         embed = nextcord.Embed(title=options_data["Option Symbol"], description=options_data["Underlying"], color=0x3498DB)
@@ -253,4 +323,5 @@ async def handle_options(message, symbols):
         logging.warning(f"KeyError processing options for message {message.content}: {ex}")
 
 
-bot.run(DISCORD_TOKEN)
+if __name__ == "__main__":
+    bot.run(DISCORD_TOKEN)
@@ -1,17 +1,32 @@
 """Functions and Info specific to the Telegram Bot
 """
 
+import logging
 import re
 
 import requests as r
 
+from common.sessions import get_session
+
+log = logging.getLogger(__name__)
+
+LICENSE_URL = "https://gitlab.com/simple-stock-bots/simple-stock-bot/-/raw/master/LICENSE"
+
+
+def fetch_license() -> str:
+    """Downloads the license, falling back to a link so the bot can still start when GitLab is down."""
+    try:
+        resp = get_session("gitlab").get(LICENSE_URL, timeout=10)
+        resp.raise_for_status()
+    except r.RequestException as e:
+        log.warning(f"Failed to download the license: {e}")
+        return f"This bot is MIT licensed, see the full license [here]({LICENSE_URL})."
+
+    return re.sub(r"\b\n", " ", resp.text)
+
 
 class T_info:
-    license = re.sub(
-        r"\b\n",
-        " ",
-        r.get("https://gitlab.com/simple-stock-bots/simple-stock-bot/-/raw/master/LICENSE").text,
-    )
+    license = fetch_license()
 
     help_text = """
 Appreciate this bot? Show support by [buying me a beer](https://www.buymeacoffee.com/Anson) 🍻.
@@ -35,6 +50,7 @@ E.g., `What's $$btc's price since $tsla accepts it?` gives Bitcoin and Tesla pri
 - `/intra $[symbol]`: Today's stock activity. 📈
 - `/chart $[symbol]`: Past month's stock chart. 📊
 - `/trending`: What's hot in stocks and cryptos. 💬
+- `/window [seconds]`: How often a symbol is answered in this chat. ⏱️
 - `/help`: Bot assistance. 🆘
 
 **Inline Features**
@@ -67,4 +83,5 @@ help - Get some help using the bot. 🆘
 trending - Trending Stocks and Cryptos. 💬
 intra - $[symbol] Plot since the last market open. 📈
 chart - $[chart] Plot of the past month. 📊
+window - [seconds] How often a symbol is answered in this chat. ⏱️
 """
@@ -1,7 +1,7 @@
 # Works with Python 3.8
+import asyncio
 import datetime
 import html
-import io
 import json
 import logging
 import os
@@ -10,10 +10,14 @@ import string
 import traceback
 from uuid import uuid4
 
-import mplfinance as mpf
 from T_info import T_info
 
 import telegram
+from common import metrics
+from common.chart_renderer import ChartQueueFull, ChartRenderer
+from common.metrics import HANDLER_SECONDS
+from common.reply_window import MAX_WINDOW, ReplyWindow
+from common.scheduler import scheduler
 from common.symbol_router import Router
 from telegram import InlineQueryResultArticle, InputTextMessageContent, LabeledPrice, Update
 from telegram.ext import (
@@ -25,6 +29,7 @@ from telegram.ext import (
     PreCheckoutQueryHandler,
     filters,
 )
+from telegram.request import BaseRequest
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -42,8 +47,14 @@ except KeyError:
     STRIPE_TOKEN = ""
     log.warning("Starting without a STRIPE Token will not allow you to accept Donations!")
 
-s = Router()
-t = T_info()
+# Chart workers run this script again as __mp_main__ when they start, where they only need the handlers defined.
+if __name__ != "__mp_main__":
+    renderer = ChartRenderer()
+    renderer.start()
+
+    s = Router("telegram")
+    t = T_info()
+    reply_window = ReplyWindow("telegram")
 
 
 log.info("Bot script started.")
@@ -84,7 +95,9 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log.warning(f"Status command ran by {update.message.chat.username}")
     bot_resp_time = datetime.datetime.now(update.message.date.tzinfo) - update.message.date
 
-    bot_status = s.status(f"It took {bot_resp_time.total_seconds()} seconds for the bot to get your message.")
+    bot_status = await asyncio.to_thread(
+        s.status, f"It took {bot_resp_time.total_seconds()} seconds for the bot to get your message."
+    )
 
     await update.message.reply_text(
         text=bot_status,
@@ -173,7 +186,7 @@ async def symbol_detect(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.message.chat_id
         if "$" in message:
             log.info("Looking for Symbols")
-            symbols = s.find_symbols(message)
+            symbols = await asyncio.to_thread(s.find_symbols, message)
         else:
             return
     except AttributeError as ex:
@@ -185,7 +198,7 @@ async def symbol_detect(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log.info("Options detected")
         await context.bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.TYPING)
         try:
-            options_data = s.options(message, symbols)
+            options_data = await asyncio.to_thread(s.options, message, symbols)
 
             await update.message.reply_text(
                 text=generate_options_reply(options_data),
@@ -196,16 +209,21 @@ async def symbol_detect(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logging.warning(ex)
             pass
 
-    if symbols:
+    # Symbols that were just answered in this chat aren't answered again.
+    if symbols := reply_window.claim(chat_id, symbols):
         log.info(f"Symbols found: {symbols}")
         await context.bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.TYPING)
 
-        for reply in s.price_reply(symbols):
-            await update.message.reply_text(
-                text=reply,
-                parse_mode=telegram.constants.ParseMode.MARKDOWN,
-                disable_notification=True,
-            )
+        try:
+            for reply in await asyncio.to_thread(s.batch_price_reply, symbols):
+                await update.message.reply_text(
+                    text=reply,
+                    parse_mode=telegram.constants.ParseMode.MARKDOWN,
+                    disable_notification=True,
+                )
+        except Exception:
+            reply_window.release(chat_id, symbols)
+            raise
 
 
 def generate_options_reply(options_data: dict):
@@ -262,7 +280,7 @@ async def intra(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    symbols = s.find_symbols(message, trending_weight=5)
+    symbols = await asyncio.to_thread(s.find_symbols, message, trending_weight=5)
     symbol = symbols[0]
 
     if len(symbols):
@@ -271,7 +289,7 @@ async def intra(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("No symbols or coins found.")
         return
 
-    df = s.intra_reply(symbol)
+    df = await asyncio.to_thread(s.intra_reply, symbol)
     if df.empty:
         await update.message.reply_text(
             text="Invalid symbol please see `/help` for usage details.",
@@ -282,25 +300,30 @@ async def intra(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.UPLOAD_PHOTO)
 
-    buf = io.BytesIO()
-    mpf.plot(
-        df,
-        type="renko",
-        title=f"\n{symbol.name}",
-        volume="Volume" in df.keys(),
-        style="yahoo",
-        savefig=dict(fname=buf, dpi=400, bbox_inches="tight"),
-    )
-    buf.seek(0)
+    key = renderer.chart_key(symbol, "renko", "intra", df)
+    try:
+        # Charts that were already uploaded are sent again by their file_id.
+        photo = renderer.file_ids.get(key) or await renderer.render(
+            df, type="renko", title=f"\n{symbol.name}", volume="Volume" in df.keys(), key=key
+        )
+    except ChartQueueFull:
+        await update.message.reply_text("The bot is busy drawing other charts, please try again in a few seconds.")
+        return
+    except TimeoutError:
+        await update.message.reply_text("The chart took too long to draw, please try again in a few seconds.")
+        return
+
+    price_reply = (await asyncio.to_thread(s.price_reply, [symbol]))[0]
 
-    await update.message.reply_photo(
-        photo=buf,
+    sent = await update.message.reply_photo(
+        photo=photo,
         caption=f"\nIntraday chart for {symbol.name} from {df.first_valid_index().strftime('%d %b at %H:%M')} to"
         + f" {df.last_valid_index().strftime('%d %b at %H:%M %Z')}"
-        + f"\n\n{s.price_reply([symbol])[0]}",
+        + f"\n\n{price_reply}",
         parse_mode=telegram.constants.ParseMode.MARKDOWN,
         disable_notification=True,
     )
+    renderer.file_ids[key] = sent.photo[-1].file_id
 
 
 async def chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -316,7 +339,7 @@ async def chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    symbols = s.find_symbols(message, trending_weight=10)
+    symbols = await asyncio.to_thread(s.find_symbols, message, trending_weight=10)
 
     if len(symbols):
         symbol = symbols[0]
@@ -324,7 +347,7 @@ async def chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("No symbols or coins found.")
         return
 
-    df = s.chart_reply(symbol)
+    df = await asyncio.to_thread(s.chart_reply, symbol)
     if df.empty:
         await update.message.reply_text(
             text="Invalid symbol please see `/help` for usage details.",
@@ -334,24 +357,29 @@ async def chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     await context.bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.UPLOAD_PHOTO)
 
-    buf = io.BytesIO()
-    mpf.plot(
-        df,
-        type="candle",
-        title=f"\n{symbol.name}",
-        volume="Volume" in df.keys(),
-        style="yahoo",
-        savefig=dict(fname=buf, dpi=400, bbox_inches="tight"),
-    )
-    buf.seek(0)
+    key = renderer.chart_key(symbol, "candle", "1M", df)
+    try:
+        # Charts that were already uploaded are sent again by their file_id.
+        photo = renderer.file_ids.get(key) or await renderer.render(
+            df, type="candle", title=f"\n{symbol.name}", volume="Volume" in df.keys(), key=key
+        )
+    except ChartQueueFull:
+        await update.message.reply_text("The bot is busy drawing other charts, please try again in a few seconds.")
+        return
+    except TimeoutError:
+        await update.message.reply_text("The chart took too long to draw, please try again in a few seconds.")
+        return
+
+    price_reply = (await asyncio.to_thread(s.price_reply, [symbol]))[0]
 
-    await update.message.reply_photo(
-        photo=buf,
+    sent = await update.message.reply_photo(
+        photo=photo,
         caption=f"\n1 Month chart for {symbol.name} from {df.first_valid_index().strftime('%d, %b %Y')}"
-        + f" to {df.last_valid_index().strftime('%d, %b %Y')}\n\n{s.price_reply([symbol])[0]}",
+        + f" to {df.last_valid_index().strftime('%d, %b %Y')}\n\n{price_reply}",
         parse_mode=telegram.constants.ParseMode.MARKDOWN,
         disable_notification=True,
     )
+    renderer.file_ids[key] = sent.photo[-1].file_id
 
 
 async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -362,7 +390,7 @@ async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.TYPING)
 
-    trending_list = s.trending()
+    trending_list = await asyncio.to_thread(s.trending)
 
     await update.message.reply_text(
         text=trending_list,
@@ -371,6 +399,37 @@ async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def window(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows or changes how long a symbol goes unanswered in a chat after its price was posted."""
+    log.info(f"Window command ran by {update.message.chat.username}")
+    chat = update.message.chat
+
+    if not context.args:
+        await update.message.reply_text(
+            text=f"Symbols mentioned again within `{reply_window.window(chat.id):g}` seconds of being answered aren't"
+            + " answered again in this chat.\nChange it with `/window [seconds]`, `/window 0` answers every mention.",
+            parse_mode=telegram.constants.ParseMode.MARKDOWN,
+        )
+        return
+
+    if chat.type != telegram.constants.ChatType.PRIVATE:
+        member = await chat.get_member(update.message.from_user.id)
+        if member.status not in (telegram.constants.ChatMemberStatus.ADMINISTRATOR, telegram.constants.ChatMemberStatus.OWNER):
+            await update.message.reply_text("Only group admins can change the window.")
+            return
+
+    try:
+        reply_window.set_window(chat.id, float(context.args[0]))
+    except ValueError:
+        await update.message.reply_text(f"The window must be a number of seconds between 0 and {MAX_WINDOW}.")
+        return
+
+    await update.message.reply_text(
+        text=f"Symbols will be answered at most once every `{reply_window.window(chat.id):g}` seconds in this chat.",
+        parse_mode=telegram.constants.ParseMode.MARKDOWN,
+    )
+
+
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles inline query. Searches by looking if query is contained
@@ -402,7 +461,7 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             ]
         )
 
-    matches = s.inline_search(update.inline_query.query)
+    matches = await asyncio.to_thread(s.inline_search, update.inline_query.query)
 
     results = []
     for _, row in matches.iterrows():
@@ -462,45 +521,84 @@ async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log.warning(tb_string)
 
 
-def main():
-    """Start the context.bot."""
-    # Create the EventHandler and pass it your bot's token.
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+def timed(command: str, callback):
+    """Records how long `callback` takes to handle each update."""
+    return metrics.timed(HANDLER_SECONDS, bot="telegram", command=command)(callback)
+
+
+async def post_init(application: Application):
+    """Starts background jobs once the bots event loop is running."""
+    scheduler.start()
+    metrics.serve()
+
+
+async def post_shutdown(application: Application):
+    await scheduler.stop()
+    s.trending_count.save()
+
+
+def build_application(token: str = TELEGRAM_TOKEN, request: BaseRequest | None = None) -> Application:
+    """Creates the bot with every handler registered.
+
+    Parameters
+    ----------
+    token : str, optional
+        Telegram bot token, by default the TELEGRAM environment variable.
+    request : BaseRequest, optional
+        Transport used to talk to the Bot API, by default HTTPX. Used to run the handlers
+            without Telegram, see `benchmarks.load_telegram`.
+
+    Returns
+    -------
+    Application
+    """
+    builder = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
     # on different commands - answer in Telegram
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help))
-    application.add_handler(CommandHandler("license", license))
-    application.add_handler(CommandHandler("trending", trending))
-    application.add_handler(CommandHandler("random", rand_pick))
-    application.add_handler(CommandHandler("donate", donate))
-    application.add_handler(CommandHandler("status", status))
-    application.add_handler(CommandHandler("inline", inline_query))
+    application.add_handler(CommandHandler("start", timed("start", start)))
+    application.add_handler(CommandHandler("help", timed("help", help)))
+    application.add_handler(CommandHandler("license", timed("license", license)))
+    application.add_handler(CommandHandler("trending", timed("trending", trending)))
+    application.add_handler(CommandHandler("random", timed("random", rand_pick)))
+    application.add_handler(CommandHandler("donate", timed("donate", donate)))
+    application.add_handler(CommandHandler("status", timed("status", status)))
+    application.add_handler(CommandHandler("window", timed("window", window)))
+    application.add_handler(CommandHandler("inline", timed("inline", inline_query)))
 
     # Charting can be slow so they run async.
-    application.add_handler(CommandHandler("intra", intra, block=False))
-    application.add_handler(CommandHandler("intraday", intra, block=False))
-    application.add_handler(CommandHandler("day", intra, block=False))
-    application.add_handler(CommandHandler("chart", chart, block=False))
-    application.add_handler(CommandHandler("month", chart, block=False))
+    application.add_handler(CommandHandler("intra", timed("intra", intra), block=False))
+    application.add_handler(CommandHandler("intraday", timed("intraday", intra), block=False))
+    application.add_handler(CommandHandler("day", timed("day", intra), block=False))
+    application.add_handler(CommandHandler("chart", timed("chart", chart), block=False))
+    application.add_handler(CommandHandler("month", timed("month", chart), block=False))
 
     # on noncommand i.e message - echo the message on Telegram
-    application.add_handler(MessageHandler(filters.TEXT, symbol_detect))
-    application.add_handler(MessageHandler(filters.PHOTO, symbol_detect_image))
+    application.add_handler(MessageHandler(filters.TEXT, timed("symbol_detect", symbol_detect)))
+    application.add_handler(MessageHandler(filters.PHOTO, timed("symbol_detect_image", symbol_detect_image)))
 
     # Inline Bot commands
-    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(InlineQueryHandler(timed("inline_query", inline_query)))
 
     # Pre-checkout handler to final check
-    application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
+    application.add_handler(PreCheckoutQueryHandler(timed("precheckout_callback", precheckout_callback)))
 
     # Payment success
-    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
+    application.add_handler(
+        MessageHandler(filters.SUCCESSFUL_PAYMENT, timed("successful_payment_callback", successful_payment_callback))
+    )
 
     # log all errors
     application.add_error_handler(error)
 
-    # Start the Bot
+    return application
+
+
+def main():
+    """Start the context.bot."""
+    application = build_application()
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 